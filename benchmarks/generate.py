@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Plugin for INGInious released under AGPL-3.0
+Created by a team at OpenWeek2019
+Florian Damhaut, Céline Deknop, Simon Gustin and Maxime Mawait
+
+Generator of realistic synthetic submissions for the benchmarks:
+- each task has a deadline, most submissions are made in the last hours before it;
+- the number of attempts of a student on a task is skewed (a few students make
+  many attempts), and weak students on hard tasks may never succeed;
+- tasks have tags (from their descriptor), failed submissions may carry
+  misconception tags in their "tests";
+- some tasks are done by teams of 2 or 3 students;
+- students belong to classrooms (INGInious "aggregations").
+The inputs are inlined in the submissions (a few lines of code), so that the
+code metrics can be computed.
+
+    python3 benchmarks/generate.py --host mongodb://localhost --database benchmark --students 500 --tasks 40
+"""
+
+import argparse
+import math
+import random
+from datetime import datetime, timedelta
+
+TAGS = ("loops", "recursion", "arrays", "strings", "pointers", "complexity", "sorting", "graphs")
+MISCONCEPTIONS = ("off_by_one", "null_dereference", "infinite_loop", "wrong_base_case")
+FAILED_RESULTS = ("failed", "failed", "failed", "timeout", "crash")
+
+# Number of submissions inserted at once
+INSERT_BATCH = 5000
+
+
+class Task(object):
+    """ A generated task (with the methods of INGInious tasks used by the plugin) """
+
+    def __init__(self, taskid, name, difficulty, deadline, tags, team_size):
+        self._id = taskid
+        self._name = name
+        self.difficulty = difficulty
+        self.deadline = deadline
+        self.tags = tags
+        self.team_size = team_size
+
+    def get_id(self):
+        return self._id
+
+    def get_name(self, language):  # pylint: disable=unused-argument
+        return self._name
+
+    def get_tags(self):
+        return ([Tag(tag) for tag in self.tags], [], [])
+
+
+class Tag(object):
+    """ A tag of a generated task """
+
+    def __init__(self, tagid):
+        self._id = tagid
+
+    def get_id(self):
+        return self._id
+
+
+class TaskFS(object):
+    """ Empty file system: the task index of generated courses is never invalidated """
+
+    def list(self, folders=True, files=True, recursive=False):  # pylint: disable=unused-argument
+        return []
+
+
+class Course(object):
+    """ A generated course (with the methods of INGInious courses used by the plugin) """
+
+    def __init__(self, courseid, tasks, students, classrooms):
+        self._id = courseid
+        self.tasks = tasks
+        self.students = students
+        self.classrooms = classrooms
+
+    def get_id(self):
+        return self._id
+
+    def get_tasks(self):
+        return {task.get_id(): task for task in self.tasks}
+
+    def get_fs(self):
+        return TaskFS()
+
+
+def make_course(courseid="benchmark", nb_students=500, nb_tasks=40, nb_classrooms=5, weeks=12, seed=0, end=None):
+    """
+    Returns the generated course `courseid`: its tasks, with deadlines spread
+    over `weeks` weeks before `end` (two days ago by default), its students
+    and their classrooms.
+    """
+    rng = random.Random(seed)
+    end = end if end is not None else datetime.now().replace(microsecond=0) - timedelta(days=2)
+    start = end - timedelta(weeks=weeks)
+    tasks = []
+    for index in range(nb_tasks):
+        deadline = start + (end - start) * (index // 4 + 1) / math.ceil(nb_tasks / 4)
+        tasks.append(Task("task{:03d}".format(index), "Task {}".format(index), rng.betavariate(2, 3),
+                          deadline.replace(hour=23, minute=59, second=0), rng.sample(TAGS, rng.randint(1, 3)),
+                          rng.choice((1, 1, 1, 2, 3))))
+    students = ["student{:05d}".format(index) for index in range(nb_students)]
+    classrooms = {student: "Classroom {}".format(index % nb_classrooms) for (index, student) in enumerate(students)}
+    return Course(courseid, tasks, students, classrooms)
+
+
+def _attempts(rng, skill, difficulty):
+    """ Number of attempts of a student of skill `skill` on a task, and whether the last one succeeds """
+    success_probability = max(0.02, min(0.95, skill - difficulty + 0.4))
+    attempts = 1
+    while rng.random() > success_probability:
+        attempts += 1
+        if attempts > 60 or rng.random() < 0.03:  # gives up
+            return attempts, False
+    return attempts, True
+
+
+def _code(rng, lines):
+    """ Returns a fake answer of `lines` lines """
+    return "\n".join("    " * rng.randint(0, 3) + "x = x + {}".format(i) if rng.random() > 0.1 else ""
+                     for i in range(lines))
+
+
+def generate_submissions(course, seed=0):
+    """ Yields the submissions of the students of the generated course `course`, in no particular order """
+    rng = random.Random(seed)
+    skills = {student: rng.betavariate(5, 2) for student in course.students}
+    for task in course.tasks:
+        # Teams are formed for each task
+        students = list(course.students)
+        rng.shuffle(students)
+        teams = [students[i:i + task.team_size] for i in range(0, len(students), task.team_size)]
+        for team in teams:
+            if rng.random() < 0.1:  # never submitted
+                continue
+            (attempts, success) = _attempts(rng, max(skills[student] for student in team), task.difficulty)
+            # Deadline spike: the first attempt is made a few hours or days before the deadline
+            first = task.deadline - timedelta(hours=rng.expovariate(1 / 20))
+            lines = max(1, int(rng.lognormvariate(3, 0.6)))
+            times = sorted(first + timedelta(minutes=rng.expovariate(1 / 15) * i) for i in range(attempts))
+            for (index, submitted_on) in enumerate(times):
+                last = index == attempts - 1
+                if last and success:
+                    grade, result = 100.0, "success"
+                    tests = {tag: True for tag in task.tags}
+                else:
+                    grade = round(100 * rng.betavariate(2, 3) * (index + 1) / attempts, 2)
+                    result = rng.choice(FAILED_RESULTS)
+                    tests = {rng.choice(MISCONCEPTIONS): True} if rng.random() < 0.3 else {}
+                lines = max(1, lines + rng.randint(-3, 5))
+                yield {
+                    "courseid": course.get_id(),
+                    "taskid": task.get_id(),
+                    "username": list(team),
+                    "submitted_on": submitted_on,
+                    "status": "done",
+                    "grade": grade,
+                    "result": result,
+                    "tests": tests,
+                    "text": "",
+                    "problems": {},
+                    "input": {"@lang": "en", "code": _code(rng, lines)}
+                }
+
+
+def populate(database, course, seed=0):
+    """
+    Replaces the submissions and classrooms of the generated course `course`
+    in `database`. Returns the number of submissions inserted.
+    """
+    courseid = course.get_id()
+    database.submissions.delete_many({"courseid": courseid})
+    database.aggregations.delete_many({"courseid": courseid})
+
+    classrooms = {}
+    for (student, classroom) in course.classrooms.items():
+        classrooms.setdefault(classroom, []).append(student)
+    database.aggregations.insert_many([{"courseid": courseid, "description": description, "students": students,
+                                        "groups": [], "tutors": [], "default": False}
+                                       for (description, students) in sorted(classrooms.items())])
+
+    count = 0
+    batch = []
+    for submission in generate_submissions(course, seed):
+        batch.append(submission)
+        if len(batch) == INSERT_BATCH:
+            database.submissions.insert_many(batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        database.submissions.insert_many(batch)
+        count += len(batch)
+    return count
+
+
+def connect(host, database_name, use_mongomock=False):
+    """ Returns the database `database_name` of the MongoDB server `host`, or of a mongomock stand-in """
+    if use_mongomock:
+        import mongomock
+        return mongomock.MongoClient()[database_name]
+    import pymongo
+    return pymongo.MongoClient(host)[database_name]
+
+
+def add_arguments(parser):
+    """ Adds the options of the generated course to the argument parser `parser` """
+    parser.add_argument("--host", default="localhost", help="MongoDB host (or URI)")
+    parser.add_argument("--database", default="adv_stats_benchmark", help="Name of the database (dropped courses only)")
+    parser.add_argument("--mongomock", action="store_true", help="Use an in-memory mongomock database")
+    parser.add_argument("--courseid", default="benchmark", help="Id of the generated course")
+    parser.add_argument("--students", type=int, default=500, help="Number of students")
+    parser.add_argument("--tasks", type=int, default=40, help="Number of tasks")
+    parser.add_argument("--classrooms", type=int, default=5, help="Number of classrooms")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generator")
+
+
+def course_from_arguments(args):
+    """ Returns the generated course described by the parsed arguments `args` """
+    return make_course(args.courseid, args.students, args.tasks, args.classrooms, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generates synthetic submissions for the benchmarks.")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    database = connect(args.host, args.database, args.mongomock)
+    count = populate(database, course_from_arguments(args), args.seed)
+    print("{}: {} submissions generated".format(args.courseid, count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+"""
+Plugin for INGInious released under AGPL-3.0
+Created by a team at OpenWeek2019
+Florian Damhaut, Céline Deknop, Simon Gustin and Maxime Mawait
+
+Benchmark suite of the statistics: each chart type is computed through the
+methods of `AdvancedCourseStatisticClass` on a generated course (see
+generate.py), in exact and histogram modes, and `compute_advanced_stats` is
+measured on arrays of growing size. For each benchmark, the median latency,
+the peak memory allocated (tracemalloc) and the number of documents received
+from MongoDB are reported.
+
+The results can be saved as a baseline, and compared with a saved baseline:
+the command fails if a chart fails, or if a benchmark got slower or bigger
+than the baseline by more than the tolerance, received more documents or
+has no result. With --allow-unsupported, the charts using aggregation
+operators that mongomock does not implement are skipped instead.
+
+The attempts before the first success are also measured with the former
+implementation (sorting and walking all the submissions in Python), on a
+course of about 1M submissions with --students 5000 --tasks 180.
+
+The results of the plugin are also checked against brute-force references
+computed from the raw submissions (histogram vs exact statistics, attempts
+before success, statistics per tag).
+
+    python3 benchmarks/run.py --host mongodb://localhost --students 2000 --tasks 50 \\
+        --save-baseline benchmarks/baselines/default.json
+    python3 benchmarks/run.py --host mongodb://localhost --students 2000 --tasks 50 \\
+        --baseline benchmarks/baselines/default.json
+
+The import time and memory of the plugin are measured by startup.py.
+"""
+
+import argparse
+import importlib
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime
+
+import numpy as np
+import web
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import generate  # pylint: disable=wrong-import-position
+
+plugin = importlib.import_module("inginious-stats")
+rollups = importlib.import_module("inginious-stats.rollups")
+metrics = importlib.import_module("inginious-stats.metrics")
+
+# Charts measured: name and fields of the form
+CHARTS = [
+    ("grades-distribution", {"chart_type": "grades-distribution"}),
+    ("grades-distribution-best", {"chart_type": "grades-distribution", "submissions_filter": "best"}),
+    ("grades-distribution-bounds", {"chart_type": "grades-distribution", "min_submission_grade": "20",
+                                    "max_submission_grade": "80"}),
+    ("grades-distribution-tags", {"chart_type": "grades-distribution", "filter_tags": "loops,graphs"}),
+    ("grades-by-task", {"chart_type": "grades-distribution", "group_by": "task"}),
+    ("grades-by-tag", {"chart_type": "grades-distribution", "group_by": "tag"}),
+    ("grades-by-classroom", {"chart_type": "grades-distribution", "group_by": "classroom"}),
+    ("grades-by-student", {"chart_type": "grades-distribution", "group_by": "student"}),
+    ("submission-before-perfect", {"chart_type": "submission-before-perfect"}),
+    ("tag-sorted", {"chart_type": "tag-sorted"}),
+    ("submissions-time-hour", {"chart_type": "submissions-time", "time_granularity": "hour"}),
+    ("submissions-time-day", {"chart_type": "submissions-time"}),
+    ("submissions-time-week", {"chart_type": "submissions-time", "time_granularity": "week",
+                               "timezone": "Europe/Brussels"}),
+    ("lines-per-submission", {"chart_type": "lines-per-submission"}),
+]
+
+# Default sizes of the arrays given to `compute_advanced_stats`
+STATS_SIZES = (10000, 1000000, 10000000)
+
+# Largest size for which `compute_advanced_stats` is also measured on a Python list
+MAX_LIST_SIZE = 1000000
+
+
+class UserManager(object):
+    """ Session of the benchmarks """
+
+    @staticmethod
+    def session_language():
+        return "en"
+
+
+class BenchmarkPage(plugin.AdvancedCourseStatisticClass):
+    """ Statistics page used outside of the webapp: a new one is created for each measured request """
+
+    def __init__(self, database):
+        super().__init__()
+        self._benchmark_database = database
+
+    @property
+    def database(self):
+        return self._benchmark_database
+
+    @property
+    def user_manager(self):
+        return UserManager
+
+
+def chart_query(fields):
+    """ Returns the parsed query, time options and groups of the form with the fields `fields` """
+    query = web.storage(stats_from='', stats_to='', chart_type='', submissions_filter='all', max_submission_grade='',
+                        min_submission_grade='', filter_tags='', filter_exercises='', time_granularity='day',
+                        timezone='', group_by='')
+    query.update(fields)
+    return plugin.parse_query(query), plugin.parse_time_options(query), plugin.parse_group_by(query)
+
+
+def measure(function, repeat):
+    """
+    Calls `function(page)` `repeat` times with a new page, then once more to
+    measure the memory (tracemalloc slows the code down).
+    :return: dict with the median latency (ms), the peak memory (KiB) and the documents received
+    """
+    latencies = []
+    for __ in range(repeat):
+        page = BenchmarkPage(DATABASE)
+        start = time.perf_counter()
+        function(page)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    page = BenchmarkPage(DATABASE)
+    tracemalloc.start()
+    try:
+        function(page)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"latency_ms": round(statistics.median(latencies), 3), "peak_kib": round(peak / 1024, 1),
+            "documents": page._transfer.documents}  # pylint: disable=protected-access
+
+
+def benchmark_charts(course, repeat, histogram, allow_unsupported=False):
+    """
+    Measures each chart of CHARTS on the course `course`.
+    :return: a tuple (dict of the results, list of the charts that failed, list of
+             the charts skipped because the database does not implement an operator
+             they use, if `allow_unsupported`)
+    """
+    plugin.PLUGIN_CONFIG["histogram_stats"] = histogram
+    suffix = " [histogram]" if histogram else ""
+    results = {}
+    failed = []
+    unsupported = []
+    for (name, fields) in CHARTS:
+        (parsed_query, time_options, group_by) = chart_query(fields)
+        try:
+            results[name + suffix] = measure(
+                lambda page: page._get_statistics(  # pylint: disable=protected-access
+                    course.get_id(), course, parsed_query, time_options, group_by), repeat)
+        except NotImplementedError as error:
+            # mongomock does not implement every aggregation operator
+            if allow_unsupported:
+                print("{}{}: skipped ({})".format(name, suffix, error))
+                unsupported.append(name + suffix)
+            else:
+                print("FAILED {}{}: {!r}".format(name, suffix, error))
+                failed.append(name + suffix)
+        except Exception as error:  # pylint: disable=broad-except
+            print("FAILED {}{}: {!r}".format(name, suffix, error))
+            failed.append(name + suffix)
+    return results, failed, unsupported
+
+
+def benchmark_stats(sizes, repeat):
+    """ Measures `compute_advanced_stats` (exact and approximate) on grades arrays of sizes `sizes` """
+    rng = np.random.RandomState(0)
+    results = {}
+    for size in sizes:
+        grades = np.round(rng.uniform(0, 100, size), 2)
+        cases = [("array", lambda: plugin.compute_advanced_stats(grades, approximate=False)),
+                 ("approximate", lambda: plugin.compute_advanced_stats(grades, approximate=True))]
+        if size <= MAX_LIST_SIZE:
+            grades_list = grades.tolist()
+            cases.append(("list", lambda: plugin.compute_advanced_stats(grades_list, approximate=False)))
+        for (kind, function) in cases:
+            results["compute_advanced_stats[{},{}]".format(kind, size)] = measure(lambda page: function(), repeat)
+    return results
+
+
+def sort_and_walk_attempts(page, courseid, daterange, grade_bounds):
+    """
+    Distribution of the attempts before the first success as computed before
+    the aggregation pipeline (`rollups.attempts_pipeline`): all the
+    submissions of the course are sorted by the database, transferred and
+    walked in Python.
+    """
+    task_data = page._stats_database.submissions.aggregate(  # pylint: disable=protected-access
+        [{"$match": {"submitted_on": {"$gte": daterange[0], "$lt": daterange[1]}, "courseid": courseid}},
+         {"$sort": {"submitted_on": 1}}], allowDiskUse=True)
+    result = {}
+    for x in task_data:
+        state = result.setdefault(x["username"][0], {}).setdefault(x["taskid"], {"attempts": 0, "done": False})
+        if x["result"] == "success":
+            state["done"] = True
+        if x["grade"] < grade_bounds[0] or x["grade"] > grade_bounds[1]:
+            continue
+        if not state["done"]:
+            state["attempts"] += 1
+    distribution = {}
+    for states in result.values():
+        for state in states.values():
+            distribution[state["attempts"]] = distribution.get(state["attempts"], 0) + 1
+    return distribution
+
+
+def benchmark_attempts(course, repeat):
+    """
+    Measures the attempts before the first success computed by the aggregation
+    pipeline and by the former sort-and-walk implementation
+    """
+    plugin.PLUGIN_CONFIG["histogram_stats"] = False
+    (parsed_query, __, __) = chart_query({"chart_type": "submission-before-perfect"})
+    daterange = parsed_query[1]
+    results = {}
+    for grade_bounds in ((0, 100), (20, 80)):
+        results["attempts{} [pipeline]".format(grade_bounds)] = measure(
+            lambda page: page._get_task_failed_attempts(  # pylint: disable=protected-access
+                course.get_id(), None, daterange, grade_bounds), repeat)
+        results["attempts{} [sort-and-walk]".format(grade_bounds)] = measure(
+            lambda page: sort_and_walk_attempts(page, course.get_id(), daterange, grade_bounds), repeat)
+    return results
+
+
+def reference_attempts(submissions, grade_bounds):
+    """
+    Brute-force distribution of the attempts before the first success: the
+    submissions are walked by date, for each (first) student and task.
+    """
+    attempts = defaultdict(int)
+    succeeded = set()
+    for submission in sorted(submissions, key=lambda submission: submission["submitted_on"]):
+        key = (submission["username"][0], submission["taskid"])
+        if key in succeeded:
+            continue
+        attempts[key] += 0  # students succeeding at their first attempt are counted too
+        if submission["result"] == "success":
+            succeeded.add(key)
+        elif grade_bounds[0] <= submission["grade"] <= grade_bounds[1]:
+            attempts[key] += 1
+    distribution = defaultdict(int)
+    for count in attempts.values():
+        distribution[count] += 1
+    return dict(distribution)
+
+
+def reference_tags(submissions, tasks):
+    """ Brute-force count, min, max and mean of the grades of each tag (counted once per student of the submission) """
+    grades = defaultdict(list)
+    for submission in submissions:
+        for tag in tasks.get_tags(submission["taskid"]):
+            grades[tag].extend([submission["grade"]] * len(submission["username"]))
+    return {tag: (len(values), min(values), max(values), sum(values) / len(values)) for (tag, values) in grades.items()}
+
+
+def check(name, condition, details=""):
+    """ Prints the result of a check and returns it """
+    print("{} {}{}".format("OK    " if condition else "FAILED", name, "" if condition else ": " + details))
+    return condition
+
+
+def run_checks(course, histogram):
+    """ Checks the results of the plugin against brute-force references, returns False if one fails """
+    plugin.PLUGIN_CONFIG["histogram_stats"] = histogram
+    suffix = " [histogram]" if histogram else ""
+    courseid = course.get_id()
+    (parsed_query, __, __) = chart_query({"chart_type": "grades-distribution"})
+    daterange = parsed_query[1]
+    submissions = list(DATABASE.submissions.find(
+        {"courseid": courseid, "submitted_on": {"$gte": daterange[0], "$lt": daterange[1]}}, {"input": 0}))
+    ok = True
+
+    # Statistics of all the grades
+    page = BenchmarkPage(DATABASE)
+    tasks = plugin.TASK_INDEX.get(course)
+    computed = plugin.compute_advanced_stats(page._get_all_distribution(  # pylint: disable=protected-access
+        courseid, tasks, daterange, [], [], (0, 100)))
+    all_grades = [submission["grade"] for submission in submissions for __ in submission["username"]]
+    expected = plugin.compute_advanced_stats(all_grades, approximate=False)
+    ok &= check("grades statistics" + suffix,
+                computed["count"] == expected["count"] and np.isclose(computed["mean"], expected["mean"]) and
+                np.isclose(computed["variance"], expected["variance"]) and computed["min"] == expected["min"] and
+                computed["max"] == expected["max"] and
+                all(abs(computed[key] - expected[key]) <= 1 for key in ("median", "p10", "p25", "p75", "p90")),
+                "{} != {}".format(computed, expected))
+
+    # Attempts before success
+    for grade_bounds in ((0, 100), (20, 80)):
+        computed = BenchmarkPage(DATABASE)._get_task_failed_attempts(  # pylint: disable=protected-access
+            courseid, None, daterange, grade_bounds)
+        expected = reference_attempts(submissions, grade_bounds)
+        ok &= check("attempts before success {}{}".format(grade_bounds, suffix),
+                    {int(key): value for (key, value) in computed.items()} == expected,
+                    "{} != {}".format(sorted(computed.items())[:10], sorted(expected.items())[:10]))
+        former = sort_and_walk_attempts(BenchmarkPage(DATABASE), courseid, daterange, grade_bounds)
+        ok &= check("attempts before success {}, sort-and-walk{}".format(grade_bounds, suffix), former == expected,
+                    "{} != {}".format(sorted(former.items())[:10], sorted(expected.items())[:10]))
+
+    # Statistics per tag
+    computed = BenchmarkPage(DATABASE)._tags_stats(courseid, tasks, daterange, (0, 100))  # pylint: disable=protected-access
+    expected = reference_tags(submissions, tasks)
+    ok &= check("statistics per tag" + suffix, set(computed) == set(expected) and all(
+        computed[tag]["grades"].count == expected[tag][0] and computed[tag]["minGrade"] == expected[tag][1] and
+        computed[tag]["maxGrade"] == expected[tag][2] and np.isclose(computed[tag]["averageGrade"], expected[tag][3])
+        for tag in expected), "{} != {}".format(sorted(computed), sorted(expected)))
+    return ok
+
+
+def compare(results, baseline, tolerance, skipped=()):
+    """
+    Prints the benchmarks that regressed compared to `baseline`, or that are
+    in the baseline but have no result (except those of `skipped`), returns
+    False if there are some
+    """
+    ok = True
+    for name in sorted(set(baseline) - set(results) - set(skipped)):
+        ok = False
+        print("REGRESSION {}: no result".format(name))
+    for (name, result) in sorted(results.items()):
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        regressions = []
+        for key in ("latency_ms", "peak_kib"):
+            if result[key] > reference[key] * (1 + tolerance):
+                regressions.append("{} {} > {}".format(key, result[key], reference[key]))
+        if result["documents"] > reference["documents"]:
+            regressions.append("documents {} > {}".format(result["documents"], reference["documents"]))
+        if regressions:
+            ok = False
+            print("REGRESSION {}: {}".format(name, ", ".join(regressions)))
+    return ok
+
+
+def print_results(results):
+    """ Prints the results as a table """
+    width = max(len(name) for name in results) if results else 0
+    print("{:<{width}}  {:>12}  {:>12}  {:>10}".format("benchmark", "latency (ms)", "peak (KiB)", "documents", width=width))
+    for (name, result) in sorted(results.items()):
+        print("{:<{width}}  {:>12.1f}  {:>12.1f}  {:>10}".format(
+            name, result["latency_ms"], result["peak_kib"], result["documents"], width=width))
+
+
+DATABASE = None
+
+
+def main():
+    global DATABASE  # pylint: disable=global-statement
+
+    parser = argparse.ArgumentParser(description="Benchmarks the charts of the advanced statistics plugin.")
+    generate.add_arguments(parser)
+    parser.add_argument("--keep", action="store_true", help="Reuse the submissions already generated for the course")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of measures of each benchmark")
+    parser.add_argument("--rollups", action="store_true", help="Roll up the course before the histogram benchmarks")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in STATS_SIZES),
+                        help="Sizes of the arrays given to compute_advanced_stats (comma separated, empty to skip)")
+    parser.add_argument("--no-checks", action="store_true", help="Skip the checks against the brute-force references")
+    parser.add_argument("--save-baseline", metavar="FILE", help="Save the results as a baseline")
+    parser.add_argument("--baseline", metavar="FILE", help="Compare the results with a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown compared to the baseline")
+    parser.add_argument("--allow-unsupported", action="store_true",
+                        help="Skip the charts using aggregation operators the database does not implement (mongomock)")
+    args = parser.parse_args()
+
+    DATABASE = generate.connect(args.host, args.database, args.mongomock)
+    plugin.RESULT_CACHE.configure(0, 0)  # every request is computed
+    plugin.create_indexes(DATABASE)
+    course = generate.course_from_arguments(args)
+    if not args.keep or DATABASE.submissions.count_documents({"courseid": args.courseid}) == 0:
+        rollups.reset_course(DATABASE, args.courseid)
+        DATABASE[metrics.METRICS].delete_many({"courseid": args.courseid})
+        generate.populate(DATABASE, course, args.seed)
+        metrics.store_metrics(DATABASE, DATABASE.submissions.find({"courseid": args.courseid}))
+    nb_submissions = DATABASE.submissions.count_documents({"courseid": args.courseid})
+    print("{} submissions, {} students, {} tasks".format(nb_submissions, args.students, args.tasks))
+
+    ok = True
+    results = {}
+    failed = []
+    unsupported = []
+    for histogram in (False, True):
+        if histogram and args.rollups:
+            rollups.roll_up_course(DATABASE, args.courseid)
+        (chart_results, chart_failed, chart_unsupported) = benchmark_charts(
+            course, args.repeat, histogram, args.allow_unsupported)
+        results.update(chart_results)
+        failed.extend(chart_failed)
+        unsupported.extend(chart_unsupported)
+        if not histogram:
+            results.update(benchmark_attempts(course, args.repeat))
+    ok &= not failed
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip() != ""]
+    results.update(benchmark_stats(sizes, args.repeat))
+    print_results(results)
+
+    if not args.no_checks:
+        ok &= run_checks(course, histogram=False)
+        ok &= run_checks(course, histogram=True)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            ok &= compare(results, json.load(file)["results"], args.tolerance, unsupported)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        with open(args.save_baseline, "w") as file:
+            json.dump({"date": datetime.now().isoformat(), "python": platform.python_version(),
+                       "numpy": np.__version__, "submissions": nb_submissions, "students": args.students,
+                       "tasks": args.tasks, "rollups": args.rollups, "results": results}, file, indent=2, sort_keys=True)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
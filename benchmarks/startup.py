@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Plugin for INGInious released under AGPL-3.0
+Created by a team at OpenWeek2019
+Florian Damhaut, Céline Deknop, Simon Gustin and Maxime Mawait
+
+Startup benchmark: time and peak resident memory of the import of the
+plugin and of its `init()` (what every webapp worker pays at startup), then
+of the first computation of statistics (which imports NumPy).
+`init()` is called with a stand-in plugin manager and database, which only
+record the pages and hooks.
+The same measures are made with NumPy (and SciPy, if installed) imported
+with the plugin, as before they were imported lazily, for comparison.
+Each run uses a fresh interpreter.
+
+    python3 benchmarks/startup.py [--runs 5]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MEASURE = """
+import importlib, json, resource, sys, time
+sys.path.insert(0, {root!r})
+
+def peak_rss():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class Collection(object):
+    def create_index(self, *args, **kwargs):
+        pass
+
+class Database(object):
+    def __getitem__(self, name):
+        return Collection()
+
+    def __getattr__(self, name):
+        return Collection()
+
+class PluginManager(object):
+    def get_database(self):
+        return Database()
+
+    def add_hook(self, *args):
+        pass
+
+    def add_page(self, *args):
+        pass
+
+result = {{"baseline_rss": peak_rss()}}
+start = time.perf_counter()
+if {eager!r}:
+    import numpy
+    try:
+        import scipy.stats
+    except ImportError:
+        pass
+plugin = importlib.import_module("inginious-stats")
+plugin.init(PluginManager(), None, None, {{}})
+result["init_time"] = time.perf_counter() - start
+result["init_rss"] = peak_rss()
+result["numpy_at_init"] = "numpy" in sys.modules
+
+start = time.perf_counter()
+plugin.compute_advanced_stats(list(range(1000)))
+result["first_stats_time"] = time.perf_counter() - start
+result["first_stats_rss"] = peak_rss()
+print(json.dumps(result))
+"""
+
+
+def measure(eager=False):
+    """
+    Runs the measure in a fresh interpreter and returns its result (a dict).
+    If `eager`, NumPy and SciPy are imported with the plugin.
+    """
+    output = subprocess.check_output([sys.executable, "-c", MEASURE.format(root=ROOT, eager=eager)])
+    return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+
+def report(label, results):
+    """ Prints the median time and memory of the runs `results` """
+    mib = 1024 * 1024
+    baseline = statistics.median(result["baseline_rss"] for result in results)
+    print("{}:".format(label))
+    print("  NumPy imported by init(): {}".format(any(result["numpy_at_init"] for result in results)))
+    print("  Import and init():        {:.1f} ms, +{:.1f} MiB".format(
+        statistics.median(result["init_time"] for result in results) * 1000,
+        (statistics.median(result["init_rss"] for result in results) - baseline) / mib))
+    print("  First statistics:         {:.1f} ms, +{:.1f} MiB".format(
+        statistics.median(result["first_stats_time"] for result in results) * 1000,
+        statistics.median(result["first_stats_rss"] - result["init_rss"] for result in results) / mib))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures the import and init() time and memory of the plugin.")
+    parser.add_argument("--runs", type=int, default=5, help="number of fresh interpreters to measure")
+    args = parser.parse_args()
+
+    report("Lazy imports", [measure() for __ in range(args.runs)])
+    report("NumPy/SciPy imported with the plugin", [measure(eager=True) for __ in range(args.runs)])
+
+
+if __name__ == '__main__':
+    main()
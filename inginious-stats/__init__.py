@@ -5,18 +5,83 @@ Florian Damhaut, Céline Deknop, Simon Gustin and Maxime Mawait
 """
 
 import os
+import json
+import logging
+import re
+import time
 import web
 from urllib.parse import parse_qs
-import numpy as np
-from scipy import stats  # NOTE sometimes triggers a warning
 from dateutil.parser import parse as date_parse
+from dateutil.tz import gettz, tzstr
 
 from inginious.frontend.pages.course_admin.utils import INGIniousAdminPage
 from inginious.common.tags import Tag
 from datetime import datetime, date, timedelta
 
+from . import rollups
+from .cache import ResultCache, query_key
+from .queries import CountingDatabase, TransferCounter, grouped_grades_pipeline, submissions_match, submissions_pipeline
+from .profiling import ProfileHistory, RequestProfile
+from . import export
+from . import jobs
+from . import metrics
+from .tasks_index import TaskIndexCache
+from .rollups import GRADE_BINS
+from .lazy import LazyModule
+
+# NumPy is only imported when statistics are first computed
+np = LazyModule("numpy")
+
 PATH_TO_PLUGIN = os.path.abspath(os.path.dirname(__file__))
 
+_logger = logging.getLogger("inginious.webapp.plugins.adv_stats")
+
+# Plugin configuration (from configuration.yaml), filled by `init`
+PLUGIN_CONFIG = {}
+
+# Statistics of the charts, per course and parsed query
+RESULT_CACHE = ResultCache()
+
+# Timings of the last requests to the statistics page
+PROFILE_HISTORY = ProfileHistory()
+
+# Index of the tasks of each course
+TASK_INDEX = TaskIndexCache()
+
+# Background computation of the slowest charts
+JOB_QUEUE = jobs.JobQueue()
+
+# Charts computed in the background by default (option `background_charts`)
+BACKGROUND_CHARTS = ("grades-distribution", "submission-before-perfect")
+
+# Granularities of the submissions timeline: step between two points and
+# resolution of their labels (as arguments of np.timedelta64 and NumPy datetime units)
+TIME_GRANULARITIES = {
+    "hour": ((1, "h"), "m"),
+    "day": ((1, "D"), "D"),
+    "week": ((7, "D"), "D")
+}
+
+# Percentiles given with the statistics, as keys "p<percentile>"
+PERCENTILES = (10, 25, 75, 90)
+
+# Timezones accepted by MongoDB: names of the tz database and UTC offsets
+TIMEZONE_NAME = re.compile(r"^[A-Za-z][A-Za-z0-9_+-]*(/[A-Za-z0-9_+-]+)*$")
+TIMEZONE_OFFSET = re.compile(r"^[+-][0-9]{2}(:?[0-9]{2})?$")
+
+# Number of bins of the histogram used by the approximate statistics
+APPROXIMATE_BINS = 1024
+
+# Largest range of integer data points whose mode is found with a bincount
+MAX_BINCOUNT_RANGE = 1 << 20
+
+# Groups that the grades distribution can be compared across
+GROUP_BY_OPTIONS = ("task", "tag", "classroom", "student")
+
+# Columns of the matrix of statistics per group (see `compute_grouped_stats`)
+GROUP_STATS = ("count", "min", "max", "mean", "median", "mode", "variance", "std_deviation") + \
+              tuple("p{}".format(percentile) for percentile in PERCENTILES)
+
 class StaticMockPage(object):
     # TODO: Replace by shared static middleware and let webserver serve the files
 
@@ -84,6 +149,39 @@ def parse_query(query):
 
     return (query.chart_type, date_range, exercise_list, tag_list, grade_bounds, query.submissions_filter)
 
+def parse_time_options(query):
+    """
+    Parses the options of the submissions timeline in the query for a chart.
+    Unknown granularities fall back to "day", timezones that MongoDB does not
+    accept to None (dates as stored in the database).
+    @return: a tuple (granularity, timezone)
+    """
+    granularity = query.time_granularity if query.time_granularity in TIME_GRANULARITIES else "day"
+    timezone = query.timezone.strip()
+    if not is_mongodb_timezone(timezone):
+        timezone = None
+    return (granularity, timezone)
+
+def is_mongodb_timezone(timezone):
+    """
+    Returns True if MongoDB accepts the timezone `timezone`: a name of the tz
+    database (such as "Europe/Brussels"), or a UTC offset ("+02:00", "-0530", "+03").
+    POSIX TZ strings (such as "EST5EDT,M3.2.0,M11.1.0"), which dateutil parses, are not accepted.
+    """
+    if TIMEZONE_OFFSET.match(timezone):
+        return True
+    if not TIMEZONE_NAME.match(timezone):
+        return False
+    zone = gettz(timezone)
+    return zone is not None and not isinstance(zone, tzstr)
+
+def parse_group_by(query):
+    """
+    Parses the groups across which the grades distribution is compared.
+    @return: one of GROUP_BY_OPTIONS, or None to compute a single distribution
+    """
+    return query.group_by if query.group_by in GROUP_BY_OPTIONS else None
+
 def apply_grade_filter(grade_list, grade_bounds):
     """
     Returns the list `grade_list` without all the grades that are not
@@ -107,21 +205,117 @@ def aggregate_all_grades(query_result):
         if "allGrades" in exercise:
             result.extend(exercise["allGrades"])
     return result
+
+
+class GradeAccumulator(object):
+    """
+    Mergeable statistics of a set of grades, in constant memory:
+    count, sum, sum of squares, min, max and histogram (`GRADE_BINS` buckets,
+    bucket `i` containing the grades in [i, i+1[).
+    """
+
+    __slots__ = ("count", "sum", "sum_squares", "min", "max", "histogram")
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.sum_squares = 0.0
+        self.min = None
+        self.max = None
+        self.histogram = np.zeros(GRADE_BINS, dtype=np.int64)
+
+    @classmethod
+    def from_grades(cls, grades):
+        """ Returns the accumulator of the list of grades `grades` """
+        accumulator = cls()
+        grades = np.asarray(grades, dtype=np.float64)
+        if grades.size == 0:
+            return accumulator
+        accumulator.count = int(grades.size)
+        accumulator.sum = float(grades.sum())
+        accumulator.sum_squares = float(np.dot(grades, grades))
+        accumulator.min = float(grades.min())
+        accumulator.max = float(grades.max())
+        buckets = np.clip(np.floor(grades), 0, GRADE_BINS - 1).astype(np.int64)
+        accumulator.histogram = np.bincount(buckets, minlength=GRADE_BINS)
+        return accumulator
+
+    @classmethod
+    def from_summary(cls, summary):
+        """ Returns the accumulator of the grade summary `summary` (see `to_summary`) """
+        accumulator = cls()
+        accumulator.count = summary["count"]
+        accumulator.sum = summary["sum"]
+        accumulator.sum_squares = summary["sum_squares"]
+        accumulator.min = summary["min"]
+        accumulator.max = summary["max"]
+        accumulator.histogram = np.asarray(summary["histogram"], dtype=np.int64)
+        return accumulator
+
+    def merge(self, other):
+        """ Adds the grades of the accumulator `other` to this one, and returns it """
+        self.count += other.count
+        self.sum += other.sum
+        self.sum_squares += other.sum_squares
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+        self.histogram = self.histogram + other.histogram
+        return self
+
+    def mean(self):
+        """ Returns the mean of the grades, or None if there are none """
+        return self.sum / self.count if self.count else None
+
+    def to_summary(self):
+        """
+        Returns the grade summary of the accumulator: a dict with the count, sum,
+        sum of squares, min, max and histogram (list of counts) of the grades,
+        as used by `compute_histogram_stats`.
+        """
+        return {"count": self.count, "sum": self.sum, "sum_squares": self.sum_squares,
+                "min": self.min, "max": self.max, "histogram": self.histogram.tolist()}
+
+
+def task_grade_accumulator(task_stats):
+    """
+    Returns the accumulator of the grades of a dict returned by `_tasks_stats`
+    (which contains either all the grades or, in histogram mode, a grade summary).
+    """
+    if "summary" in task_stats:
+        return GradeAccumulator.from_summary(task_stats["summary"])
+    return GradeAccumulator.from_grades(task_stats["allGrades"])
+
+
+def aggregate_grade_summaries(query_result):
+    """
+    Histogram counterpart of `aggregate_all_grades`:
+    given a list of dicts where each dict represents an exercise and
+    contains the grade summary for this exercise (key "summary"),
+    merges them in just one summary and returns it.
+    """
+    result = GradeAccumulator()
+    for exercise in query_result:
+        if "summary" in exercise:
+            result.merge(GradeAccumulator.from_summary(exercise["summary"]))
+    return result.to_summary()
+
+
 def process_nb_attempts_dict(query_result):
     """
-    Given a dict containing the number of attempts before 100% for each user
-    and task,
-    returns a list of all the number of attempts (without the additional
-    information contained in the dict).
+    Given a dict mapping a number of attempts before 100% to the number of
+    users and tasks with this number of attempts (or any other distribution,
+    such as the number of lines of the submissions),
+    returns a (sorted) list of all the number of attempts.
     """
     result = []
-    for username in query_result:
-        for task_id in query_result[username]:
-            result.append(query_result[username][task_id]["attempts"])
+    for attempts in sorted(query_result):
+        result.extend([attempts]*query_result[attempts])
     return result
 
 
-def compute_advanced_stats(data):
+def compute_advanced_stats(data, approximate=None):
     """
     Given a list of (numeric) data points `data`,
     computes advanced statistics on them.
@@ -135,21 +329,258 @@ def compute_advanced_stats(data):
         - mode
         - variance
         - standard deviation (key "std_deviation")
+        - percentiles 10, 25, 75 and 90 (keys "p10", "p25", "p75" and "p90")
+    The data points are converted once to a float array. The median and
+    percentiles come from a single partial sort (`np.partition`), and the
+    mode from a bincount when the data points are integers in a bounded range.
+    If `approximate` (by default, when there are more data points than the
+    option `approximate_stats_above`), the median, mode and percentiles are
+    read from a histogram of `APPROXIMATE_BINS` bins between min and max
+    instead, as for grade summaries.
     """
-    count = len(data)
+    if isinstance(data, dict):
+        return compute_histogram_stats(data)
+
+    values = np.asarray(data, dtype=np.float64).ravel()
+    count = values.size
     if count == 0:
         return None
+    if approximate is None:
+        approximate = 0 < PLUGIN_CONFIG.get("approximate_stats_above", 0) < count
+
+    minimum = values.min()
+    maximum = values.max()
+    mean = values.sum() / count
+    deviations = values - mean
+    variance = np.dot(deviations, deviations) / count
+    del deviations
+
+    quantiles = (50,) + PERCENTILES
+    if approximate:
+        width = (maximum - minimum) / APPROXIMATE_BINS or 1.0
+        bins = np.minimum(((values - minimum) / width).astype(np.int64), APPROXIMATE_BINS - 1)
+        histogram = np.bincount(bins, minlength=APPROXIMATE_BINS)
+        quantile_values = np.clip(_histogram_quantiles(histogram, count, quantiles, minimum, width), minimum, maximum)
+        mode = minimum + width * np.argmax(histogram)
+    else:
+        # Same interpolation as np.percentile, with one partial sort for all the quantiles
+        positions = np.asarray(quantiles, dtype=np.float64) / 100 * (count - 1)
+        lower = np.floor(positions).astype(np.int64)
+        upper = np.ceil(positions).astype(np.int64)
+        partitioned = np.partition(values, np.unique(np.concatenate((lower, upper))))
+        quantile_values = partitioned[lower] + (partitioned[upper] - partitioned[lower]) * (positions - lower)
+        mode = _exact_mode(values, minimum, maximum)
+
+    result = {
+        "count": count,
+        "min": minimum,
+        "max": maximum,
+        "mean": mean,
+        "median": quantile_values[0],
+        "mode": mode,
+        "variance": variance,
+        "std_deviation": np.sqrt(variance)
+    }
+    result.update(("p{}".format(percentile), value) for (percentile, value) in zip(PERCENTILES, quantile_values[1:]))
+    return result
 
-    return {
+
+def _exact_mode(values, minimum, maximum):
+    """ Returns the smallest most frequent value of the float array `values` """
+    if maximum - minimum <= MAX_BINCOUNT_RANGE and np.all(np.mod(values, 1) == 0):
+        return minimum + np.argmax(np.bincount((values - minimum).astype(np.int64)))
+    (uniques, counts) = np.unique(values, return_counts=True)
+    return uniques[np.argmax(counts)]
+
+
+def _histogram_quantiles(histogram, count, quantiles, first=0.0, width=1.0):
+    """
+    Returns the array of the quantiles `quantiles` (in percents) of the
+    `count` data points counted in `histogram`, whose bin i starts at
+    `first + i * width`. Each data point is taken as the start of its bin,
+    and the quantiles are interpolated between two data points as in np.percentile.
+    """
+    cumulative = np.cumsum(histogram)
+    positions = np.asarray(quantiles, dtype=np.float64) / 100 * (count - 1)
+    lower = np.floor(positions)
+    lower_values = first + width * np.searchsorted(cumulative, lower, side="right")
+    upper_values = first + width * np.searchsorted(cumulative, np.ceil(positions), side="right")
+    return lower_values + (upper_values - lower_values) * (positions - lower)
+
+
+def compute_histogram_stats(summary):
+    """
+    Given a grade summary `summary` (see `GradeAccumulator.to_summary`),
+    computes the same statistics as `compute_advanced_stats` without
+    needing the grades themselves:
+        - count, min, max, mean, variance and standard deviation are exact
+        - median, mode and percentiles are the lower bound of the histogram
+          bucket they fall into (exact for integer grades)
+    """
+    count = summary["count"]
+    if count == 0:
+        return None
+
+    mean = summary["sum"] / count
+    variance = max(summary["sum_squares"] / count - mean ** 2, 0.0)
+
+    histogram = np.asarray(summary["histogram"])
+    quantile_values = np.clip(_histogram_quantiles(histogram, count, (50,) + PERCENTILES),
+                              summary["min"], summary["max"])
+
+    result = {
         "count": count,
-        "min": np.amin(data),
-        "max": np.amax(data),
-        "mean": np.mean(data),
-        "median": np.median(data),
-        "mode": stats.mode(data).mode[0],
-        "variance": np.var(data),
-        "std_deviation": np.std(data)
+        "min": summary["min"],
+        "max": summary["max"],
+        "mean": mean,
+        "median": quantile_values[0],
+        "mode": int(np.argmax(histogram)),
+        "variance": variance,
+        "std_deviation": np.sqrt(variance)
     }
+    result.update(("p{}".format(percentile), value) for (percentile, value) in zip(PERCENTILES, quantile_values[1:]))
+    return result
+
+
+def compute_grouped_stats(keys, bins, counts, sums, sum_squares, minimums, maximums):
+    """
+    Computes the statistics of `compute_histogram_stats` for all the groups
+    at once, on a matrix with one histogram per group.
+    Each index i of the arguments describes the `counts[i]` grades of the
+    group `keys[i]` in the histogram bucket `bins[i]`: their sum, sum of
+    squares, minimum and maximum (as returned by `grouped_grades_pipeline`).
+    @return: a tuple (sorted array of the groups, matrix with one row per group
+             and one column per statistic of GROUP_STATS, grade summary of all
+             the groups together)
+    """
+    (groups, group_index) = np.unique(np.asarray(keys), return_inverse=True)
+    nb_groups = len(groups)
+    buckets = np.clip(np.asarray(bins, dtype=np.int64), 0, GRADE_BINS - 1)
+    histograms = np.zeros((nb_groups, GRADE_BINS), dtype=np.int64)
+    np.add.at(histograms, (group_index, buckets), np.asarray(counts, dtype=np.int64))
+
+    total = histograms.sum(axis=1)
+    mean = np.bincount(group_index, weights=sums, minlength=nb_groups) / total
+    variance = np.maximum(np.bincount(group_index, weights=sum_squares, minlength=nb_groups) / total - mean ** 2, 0.0)
+    minimum = np.full(nb_groups, np.inf)
+    np.minimum.at(minimum, group_index, np.asarray(minimums, dtype=np.float64))
+    maximum = np.full(nb_groups, -np.inf)
+    np.maximum.at(maximum, group_index, np.asarray(maximums, dtype=np.float64))
+
+    # Quantiles of all the groups, as in `_histogram_quantiles`: the bucket of
+    # the grade of rank r is the number of cumulative counts <= r
+    cumulative = np.cumsum(histograms, axis=1)
+    positions = np.outer(total - 1, np.asarray((50,) + PERCENTILES, dtype=np.float64) / 100)
+    lower = np.floor(positions)
+    lower_values = (cumulative[:, np.newaxis, :] <= lower[:, :, np.newaxis]).sum(axis=2)
+    upper_values = (cumulative[:, np.newaxis, :] <= np.ceil(positions)[:, :, np.newaxis]).sum(axis=2)
+    quantiles = np.clip(lower_values + (upper_values - lower_values) * (positions - lower),
+                        minimum[:, np.newaxis], maximum[:, np.newaxis])
+
+    matrix = np.column_stack((total, minimum, maximum, mean, quantiles[:, 0], np.argmax(histograms, axis=1),
+                              variance, np.sqrt(variance), quantiles[:, 1:]))
+    summary = {"count": int(total.sum()), "sum": float(np.sum(sums)), "sum_squares": float(np.sum(sum_squares)),
+               "min": float(minimum.min()), "max": float(maximum.max()), "histogram": histograms.sum(axis=0).tolist()}
+    return (groups, matrix, summary)
+
+
+def time_bucket_expression(granularity, timezone=None):
+    """
+    Returns the aggregation expression giving the label of the time bucket
+    (hour, day or week, in the timezone `timezone`) of a submission.
+    Week buckets are labelled by their Monday.
+    """
+    date = {"date": "$submitted_on"}
+    if timezone is not None:
+        date["timezone"] = timezone
+
+    if granularity == "hour":
+        return {"$dateToString": dict(date, format="%Y-%m-%dT%H:00")}
+    if granularity == "week":
+        monday = {"$dateFromParts": {"isoWeekYear": {"$isoWeekYear": date}, "isoWeek": {"$isoWeek": date},
+                                     "isoDayOfWeek": 1}}
+        return {"$dateToString": {"format": "%Y-%m-%d", "date": monday}}
+    return {"$dateToString": dict(date, format="%Y-%m-%d")}
+
+
+def fill_time_gaps(timestamps, counts, granularity):
+    """
+    Given the sorted labels `timestamps` of non-empty time buckets and
+    their number of submissions `counts`, adds the empty buckets between them.
+    @return: a tuple (list of labels, list of number of submissions)
+    """
+    if len(timestamps) == 0:
+        return ([], [])
+    (step, unit) = TIME_GRANULARITIES[granularity]
+    step = np.timedelta64(*step)
+    times = np.array(timestamps, dtype="datetime64[m]")
+    all_times = np.arange(times[0], times[-1] + step, step)
+    filled = np.zeros(len(all_times), dtype=np.int64)
+    filled[((times - times[0]) / step).astype(np.int64)] = counts
+    return (list(np.datetime_as_string(all_times, unit=unit)), filled.tolist())
+
+
+def bin_chart_data(chart_type, statistics, grade_bounds, nb_bars=20):
+    """
+    Given the statistics `statistics` computed for a chart of type `chart_type`,
+    returns the bars to plot, so that the raw data does not need to be sent
+    to the browser.
+    @return: a dict with the height ("bars") and label ("labels") of each bar
+    """
+    (minimum, maximum) = grade_bounds
+    if chart_type == "grades-distribution" and len(statistics["histogram"]) > 0:
+        # Histogram bucket `i` contains the grades in [i, i+1[
+        first = max(0, int(np.floor(minimum)))
+        last = min(GRADE_BINS - 1, int(np.floor(maximum)))
+        if last < first:
+            return {"bars": [], "labels": []}
+        width = max(1, int(np.ceil((last - first + 1) / nb_bars)))
+        counts = np.asarray(statistics["histogram"][first:last + 1])
+        starts = np.arange(first, last + 1, width)
+        bars = np.add.reduceat(counts, starts - first)
+        labels = [str(start) if min(start + width - 1, last) == start else "{} to {}".format(start, min(start + width - 1, last))
+                  for start in starts]
+        return {"bars": bars.tolist(), "labels": labels}
+
+    if chart_type == "grades-distribution":
+        (bars, edges) = np.histogram(statistics["raw_data"], bins=nb_bars, range=(minimum, maximum))
+        labels = ["{:g} to {:g}".format(edges[i], edges[i + 1]) for i in range(len(bars))]
+        return {"bars": bars.tolist(), "labels": labels}
+
+    if chart_type == "tag-sorted":
+        return {"bars": list(statistics["raw_data"]), "labels": list(statistics["labels"])}
+
+    if chart_type == "submission-before-perfect":
+        bars = np.bincount(np.asarray(statistics["raw_data"], dtype=np.int64))
+        return {"bars": bars.tolist(), "labels": list(range(len(bars)))}
+
+    if chart_type == "lines-per-submission":
+        # Bars of `width` consecutive numbers of lines
+        lines = np.asarray(statistics["raw_data"], dtype=np.int64)
+        first = int(lines.min())
+        width = max(1, int(np.ceil((int(lines.max()) - first + 1) / nb_bars)))
+        bars = np.bincount((lines - first) // width)
+        labels = [str(first + i * width) if width == 1 else "{} to {}".format(first + i * width, first + (i + 1) * width - 1)
+                  for i in range(len(bars))]
+        return {"bars": bars.tolist(), "labels": labels}
+
+    return {"bars": list(statistics["raw_data"]), "labels": list(statistics["times"])}
+
+
+def json_default(obj):
+    """
+    `default` function for `json.dumps`, serializing the NumPy scalars and
+    arrays and the dates found in the statistics.
+    """
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError("Object of type {} is not JSON serializable".format(type(obj).__name__))
+
+
 def compute_temporal_advanced_stats(data):
     """
     Given a list of temporal data points `data`,
@@ -169,306 +600,718 @@ def compute_temporal_advanced_stats(data):
         "median": -1,
         "mode": -1,
         "variance": -1,
-        "std_deviation": -1
+        "std_deviation": -1,
+        "p10": -1,
+        "p25": -1,
+        "p75": -1,
+        "p90": -1
     }
 
 
+def tags_stats_from_tasks(stats_tasks):
+    """
+    Given the list of dicts returned by `_tasks_stats` (one dict per task),
+    aggregates them per tag, in O(number of tasks) with constant memory per tag.
+    Returns a dict mapping each tag to a dict containing the data for this tag
+    (the statistics of its grades being in a `GradeAccumulator`, key "grades").
+    """
+    tag_stats = {}
+    for x in stats_tasks:
+        grades = None
+        for tag in x["tags"]:
+            if tag == "":
+                continue
+            if grades is None:
+                grades = task_grade_accumulator(x)
+            if tag not in tag_stats:
+                tag_stats[tag] = {"submissions": 0, "validSubmissions": 0, "grades": GradeAccumulator()}
+            tag_stats[tag]["submissions"] += x["submissions"]
+            tag_stats[tag]["validSubmissions"] += x["validSubmissions"]
+            tag_stats[tag]["grades"].merge(grades)
+
+    for tag in tag_stats.values():
+        tag["minGrade"] = tag["grades"].min
+        tag["maxGrade"] = tag["grades"].max
+        tag["averageGrade"] = tag["grades"].mean()
+    return tag_stats
+
+
 class AdvancedCourseStatisticClass(INGIniousAdminPage):
 
-    def _tasks_stats(self, courseid, tasks, daterange):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # A new page instance is created for each request: the per-task
+        # aggregation is shared by every chart built while handling it.
+        self._tasks_stats_memo = {}
+        # Counting the bytes received requires encoding the documents again
+        self._transfer = TransferCounter(count_bytes=_logger.isEnabledFor(logging.DEBUG))
+        self._profile = RequestProfile(None)
+        # Language of the session and database of the webapp, read during the
+        # request (they are only reachable from its thread, through web.ctx)
+        # so that the charts can be computed in the background
+        self._language = None
+        self._database = None
+
+    def _session_language(self):
+        """ Returns the language of the session of the request """
+        if self._language is None:
+            self._language = self.user_manager.session_language()
+        return self._language
+
+    def _session_database(self):
+        """ Returns the database of the webapp, read during the request """
+        if self._database is None:
+            self._database = self.database
+        return self._database
+
+    @property
+    def _stats_database(self):
+        """
+        Database used by the statistics queries: the documents (and bytes,
+        when debug logging is enabled) received are counted in `self._transfer`,
+        and the time spent in the database is added to `self._profile`.
+        """
+        return CountingDatabase(self._session_database(), self._transfer, self._profile,
+                                PLUGIN_CONFIG.get("profile_explain", False))
+
+    @staticmethod
+    def _use_histograms():
+        """
+        Returns True if the grade statistics should be computed from histograms
+        built in the database rather than from the list of all the grades.
+        """
+        return PLUGIN_CONFIG.get("histogram_stats", False)
+
+    def _tasks_stats(self, courseid, tasks, daterange, grade_bounds=None):
         """
-        Get statistics about the task submissions of a courseid
+        Get statistics about the task submissions of a courseid.
+        The aggregation runs once per request and daterange, the per-tag view
+        (`_tags_stats`) and every chart type reuse its result.
+        Only the submissions with grade in {grade_bounds} are taken into account.
+        In histogram mode, each dict contains a grade summary (key "summary")
+        instead of all the grades (key "allGrades").
         :param: - courseid: id of an inginious course
-                - list of the tasks for courseid
+                - index of the tasks of courseid (see `TaskIndex`)
                 - daterange period for the query
+                - grade_bounds: bounds of the grades (None for all the grades)
         :return: list of dict containing the data per task per user
         """
-        stats_tasks = self.database.submissions.aggregate(
-            [{"$match": {"submitted_on": {"$gte": daterange[0], "$lt": daterange[1]}, "courseid": courseid}},
-             {"$unwind":"$username"},
+        key = (courseid, daterange[0], daterange[1], grade_bounds)
+        if key not in self._tasks_stats_memo:
+            if not self._use_histograms():
+                self._tasks_stats_memo[key] = self._compute_tasks_stats(courseid, tasks, daterange, grade_bounds)
+            else:
+                self._tasks_stats_memo[key] = self._compute_tasks_histograms(courseid, tasks, daterange, grade_bounds)
+        return self._tasks_stats_memo[key]
+
+    def _compute_tasks_stats(self, courseid, tasks, daterange, grade_bounds=None):
+        """
+        Runs the single `$group` per task over the submissions of a courseid
+        backing `_tasks_stats`.
+        """
+        stats_tasks = self._stats_database.submissions.aggregate(
+            submissions_pipeline(submissions_match(courseid, daterange, grade_bounds=grade_bounds)) +
+            [{"$unwind":"$username"},
              {"$group": {"_id": "$taskid", "averageGrade": {"$avg": "$grade"},
                          "minGrade": {"$min": "$grade"},"maxGrade": {"$max": "$grade"},
                          "allGrades": {"$push": "$grade"}, "username": {"$first": "$username"},
                          "submissions": {"$sum": 1}, "validSubmissions":
-                 {"$sum": {"$cond": {"if": {"$eq": ["$result", "success"]}, "then": 1, "else": 0}}},
-                         "tags": {"$first": "$tests"}}
+                 {"$sum": {"$cond": {"if": {"$eq": ["$result", "success"]}, "then": 1, "else": 0}}}}
              }]
         )
 
         return [
             {"_id": x["_id"],
-             "name": tasks[x["_id"]].get_name(self.user_manager.session_language()) if x["_id"] in tasks else x["_id"],
+             "name": tasks.get_name(x["_id"], self._session_language()),
              "submissions": x["submissions"],
              "averageGrade": x["averageGrade"],
              "minGrade": x["minGrade"],
              "username": x["username"],
              "maxGrade": x["maxGrade"],
              "allGrades": x["allGrades"],
-             #"tags": [y[0].get_name() if len(y) == 1 else "" for y in tasks[x["_id"]].get_tags()],
-             "tags": [y for y in x["tags"]],
+             "tags": tasks.get_tags(x["_id"]),
              "validSubmissions": x["validSubmissions"]}
             for x in stats_tasks
         ]
 
-    def _get_best_submissions(self, courseid, tasks, tasks_id, daterange):
+    def _compute_tasks_histograms(self, courseid, tasks, daterange, grade_bounds):
+        """
+        Histogram mode of `_compute_tasks_stats`: the count, sum, sum of squares,
+        min, max and histogram of the grades of each task are computed by the
+        database, so that only `GRADE_BINS` numbers per task are transferred.
+        Without grade bounds, the days that are rolled up are read from the
+        rollups (see `rollups.py`) instead of the submissions.
         """
-            Gives a list of only the best submission for each studentourseid
+        if grade_bounds is None or grade_bounds == (0, 100):
+            stats_tasks = rollups.task_rows(self._stats_database, courseid, daterange)
+        else:
+            stats_tasks = rollups.raw_task_rows(self._stats_database, courseid, daterange, grade_bounds)
+
+        return [
+            {"_id": x["_id"],
+             "name": tasks.get_name(x["_id"], self._session_language()),
+             "submissions": x["submissions"],
+             "averageGrade": x["sumGrade"] / x["submissions"],
+             "minGrade": x["minGrade"],
+             "username": x["username"],
+             "maxGrade": x["maxGrade"],
+             "summary": {"count": x["submissions"], "sum": x["sumGrade"], "sum_squares": x["sumSquares"],
+                         "min": x["minGrade"], "max": x["maxGrade"], "histogram": x["histogram"]},
+             "tags": tasks.get_tags(x["_id"]),
+             "validSubmissions": x["validSubmissions"]}
+            for x in stats_tasks
+        ]
+
+    def _get_best_submissions(self, courseid, tasks, tasks_id, daterange, grade_bounds=None):
+        """
+            Gives a list of only the best submission for each student and task.
+            The selection is done by the database, so that only one document
+            per student and task is transferred.
             :param: - courseid: id of an inginious course
-                - list of the tasks for courseid
+                - index of the tasks of courseid (see `TaskIndex`)
+                - tasks_id: ids of the tasks to consider (all the tasks if None)
                 - daterange period for the query
+                - grade_bounds: only the submissions with a grade in these bounds are considered
             :return: list of dict containing all best submissions per user
         """
-        all_submissions = self.database.submissions.aggregate(
-            [{"$match": {"submitted_on": {"$gte": daterange[0], "$lt": daterange[1]}, "courseid": courseid,
-              "taskid": {"$in":tasks_id}}},
-             {"$unwind":"$username"},
-             {"$group": {"_id": "$_id", "grade": {"$first": "$grade"}, "task": {"$first": "$taskid"},
-                         "username": {"$first": "$username"}, "tags": {"$first": "$tests"}}
-             }]
+        best_submissions = self._stats_database.submissions.aggregate(
+            submissions_pipeline(submissions_match(courseid, daterange, tasks_id, grade_bounds)) +
+            [{"$unwind":"$username"},
+             {"$group": {"_id": {"username": "$username", "task": "$taskid"}, "grade": {"$max": "$grade"}}},
+             {"$project": {"_id": 0, "username": "$_id.username", "task": "$_id.task", "grade": 1}}
+             ], allowDiskUse=True
         )
+        return list(best_submissions)
 
-        temp_dict = {}
-        for sub in all_submissions:
-            if sub["username"]+str(sub["task"]) in temp_dict:
-                if sub["grade"] > temp_dict[sub["username"]+str(sub["task"])]["grade"]:
-                    temp_dict[sub["username"]+str(sub["task"])] = sub
-            else:
-                temp_dict[sub["username"]+str(sub["task"])] = sub
-        return list(temp_dict.values())
+    def _get_lines_distribution(self, courseid, tasks_id, daterange, grade_bounds):
+        """
+            Gives the distribution of the number of lines of the submissions for the tasks
+            {tasks_id} (all the tasks if None) during the range {daterange}, with grade in {grade_bounds}.
+            Only the metrics stored for each submission (see `metrics.py`) are read.
+            :return: dict mapping a number of lines to the number of submissions
+        """
+        distribution = self._stats_database[metrics.METRICS].aggregate([
+            {"$match": submissions_match(courseid, daterange, tasks_id, grade_bounds)},
+            {"$group": {"_id": "$lines", "submissions": {"$sum": 1}}}
+        ])
+        return {x["_id"]: x["submissions"] for x in distribution}
 
     def _get_task_failed_attempts(self, courseid, taskid, daterange, grade_bounds):
         """
-            Gives the number of failed attempts before first success
-            for each student for the task {taskid} during the range {daterange}
+            Gives the distribution of the number of failed attempts before first success
+            of the students for the task {taskid} during the range {daterange}
             and taking into account only attempts with grade in {grade_bounds}.
+            The attempts are counted by the database, only the distribution is transferred.
+            When the whole history is requested without grade bounds,
+            the progress stored with the rollups is used.
+            :return: dict mapping a number of attempts to the number of students (per task)
         """
-        (minimum, maximum) = grade_bounds
-
-        if len(taskid) == 0:
-            task_data =  self.database.submissions.aggregate(
-                [{"$match": {"submitted_on": {"$gte": daterange[0], "$lt": daterange[1]},
-                  "courseid": courseid}},
-                 {"$sort": {"submitted_on": 1}}]
-            )
-        else:
-            task_data =  self.database.submissions.aggregate(
-                [{"$match": {"submitted_on": {"$gte": daterange[0], "$lt": daterange[1]},
-                  "courseid": courseid, "taskid": {"$in":taskid}}},
-                 {"$sort": {"submitted_on": 1}}]
-            )
-
-        result = {}
-        for x in task_data:
-            username = x["username"][0]
-            task_id = x["taskid"]
-            if username not in result:
-                result[username] = dict()
-            if task_id not in result[username]:
-                result[username][task_id] = {"attempts": 0, "done": False}
-
-            if x["result"] == "success":
-                result[username][task_id]["done"] = True
-
-            if x["grade"] < minimum or x["grade"] > maximum:
-                continue
-            print("done? " + str(result[username][task_id]["done"]))
-            if not result[username][task_id]["done"]:
-                result[username][task_id]["attempts"] += 1
-        return result
+        if grade_bounds == (0, 100):
+            result = rollups.attempts_progress(self._stats_database, courseid, taskid, daterange)
+            if result is not None:
+                return result
+
+        # The grade bounds cannot be part of the match: a success out of the
+        # bounds still ends the attempts of the student
+        distribution = self._stats_database.submissions.aggregate(
+            rollups.attempts_pipeline(submissions_match(courseid, daterange, taskid), grade_bounds) +
+            [{"$group": {"_id": "$attempts", "students": {"$sum": 1}}}],
+            allowDiskUse=True
+        )
+        return {x["_id"]: x["students"] for x in distribution}
 
-    def _get_submissions_by_time(self, courseid, taskid, daterange, grade_bounds):
+    def _get_submissions_by_time(self, courseid, taskid, daterange, grade_bounds, granularity="day", timezone=None):
         """
-            Gives the number of failed attempts before first success
-            for each student for the task {taskid} during the range {daterange}
-            and taking into account only attempts with grade in {grade_bounds}.
+            Gives the number of submissions per hour, day or week ({granularity})
+            for the task {taskid} during the range {daterange}
+            and taking into account only submissions with grade in {grade_bounds}.
+            The submissions are counted by the database, and the empty buckets
+            are added afterwards. Without grade bounds nor timezone, the days
+            that are rolled up are read from the rollups.
         """
-        (minimum, maximum) = grade_bounds
-
-        if len(taskid) == 0:
-            task_data =  self.database.submissions.aggregate(
-                [{"$match": {"submitted_on": {"$gte": daterange[0], "$lt": daterange[1]},
-                  "courseid": courseid}},
-                 {"$sort": {"submitted_on": 1}}]
-            )
-        else:
-            task_data =  self.database.submissions.aggregate(
-                [{"$match": {"submitted_on": {"$gte": daterange[0], "$lt": daterange[1]},
-                  "courseid": courseid, "taskid": {"$in":taskid}}},
-                 {"$sort": {"submitted_on": 1}}]
+        submissions_per_time = {}
+        raw_ranges = [daterange]
+        if granularity == "day" and timezone is None and grade_bounds == (0, 100):
+            (submissions_per_time, raw_ranges) = rollups.submissions_per_day(self._stats_database, courseid, taskid, daterange)
+
+        for raw_range in raw_ranges:
+            task_data = self._stats_database.submissions.aggregate(
+                submissions_pipeline(submissions_match(courseid, raw_range, taskid, grade_bounds), ("submitted_on",)) +
+                [{"$group": {"_id": time_bucket_expression(granularity, timezone), "count": {"$sum": 1}}}]
             )
+            for x in task_data:
+                submissions_per_time[x["_id"]] = submissions_per_time.get(x["_id"], 0) + x["count"]
 
-        timestamps = []
-        submissions_per_timestamp = []
-        for x in task_data:
-            current_date = x["submitted_on"].date().isoformat()
-            if timestamps and current_date == timestamps[-1] :
-                submissions_per_timestamp[-1] += 1
-            else :
-                timestamps.append(current_date)
-                submissions_per_timestamp += [1]
+        timestamps = sorted(submissions_per_time)
+        return fill_time_gaps(timestamps, [submissions_per_time[time] for time in timestamps], granularity)
 
-        return (timestamps, submissions_per_timestamp)
-
-    def _tags_stats(self, courseid, tasks, daterange):
+    def _tags_stats(self, courseid, tasks, daterange, grade_bounds=None):
         """
-        Get aggregated statistics about the submissions grouped by tags
+        Get aggregated statistics about the submissions grouped by tags.
+        Derived from the (shared) per-task aggregation, no extra query is made.
         :param: - courseid: id of an inginious course
-                - list of the tasks for courseid
+                - index of the tasks of courseid (see `TaskIndex`)
                 - daterange period for the query
-        :return: list of dict containing the data per tag
-        """
-        stats_tasks = self._tasks_stats(courseid, tasks, daterange)
-        tag_stats = {}
-        for x in stats_tasks:
-            for tag in x["tags"]:
-                if tag not in tag_stats and tag != "":
-                    tag_stats[tag] = {"submissions": x["submissions"],
-                                      "validSubmissions": x["validSubmissions"],
-                                      "allGrades": x["allGrades"],
-                                      "minGrade": x["minGrade"],
-                                      "maxGrade": x["maxGrade"],
-                                      "averageGrade": x["averageGrade"]
-                                      }
-                elif tag != "":
-                    tag_stats[tag]["submissions"] += x["submissions"]
-                    tag_stats[tag]["validSubmissions"] += x["validSubmissions"]
-                    tag_stats[tag]["averageGrade"] = (tag_stats[tag]["averageGrade"]*len(tag_stats[tag]["allGrades"])
-                                                      + x["averageGrade"]*len(x["allGrades"])) / (len(tag_stats[tag]["allGrades"])+len(x["allGrades"]))
-                    tag_stats[tag]["allGrades"] = [item for sublist in tag_stats[tag]["allGrades"] for item in  x["allGrades"]]
-                    tag_stats[tag]["minGrade"] = min(tag_stats[tag]["allGrades"])
-                    tag_stats[tag]["maxGrade"] = max(tag_stats[tag]["allGrades"])
-        return tag_stats
-
-    def _get_all_distribution(self, courseid, tasks, daterange, exec_list, tag_list):
+                - grade_bounds: bounds of the grades (None for all the grades)
+        :return: dict containing the data per tag
+        """
+        return tags_stats_from_tasks(self._tasks_stats(courseid, tasks, daterange, grade_bounds))
+
+    def _get_all_distribution(self, courseid, tasks, daterange, exec_list, tag_list, grade_bounds=None):
         """
         Get aggregated statistics about all submissions of tags {tag_list} and exercices {exec_list}
         :param: - courseid: id of an inginious course
-                - list of the tasks for courseid
+                - index of the tasks of courseid (see `TaskIndex`)
                 - daterange period for the query
                 - exec_list : the list of exercice names
                 - tag_list : the list of tags
-        :return: single dict containing the data
-        """
-        stats_tags = self._tags_stats(courseid, tasks, daterange)
-        print("="*20 + "TAGS STATS" + "="*20)
-        print(stats_tags)
-        all_result = []
-
-        for tag in tag_list:
-            all_result.append(stats_tags[tag]) #Get the stats about wanted tags
-
-        stats_exec = self._tasks_stats(courseid, tasks, daterange) #Get other exercices
-        print("="*20 + "EXERCISES STATS" + "="*20)
-        print(stats_exec)
-        for task in stats_exec: #Add any missing exercices
-            add = False
-            if (len(tag_list) == 0):
-                add = True
-            for tag in tag_list:
-                if tag in task["tags"]:
-                    add = True
-            if (len(exec_list) == 0 or task["name"].strip() in exec_list) and add:
-                all_result.append(task)
+                - grade_bounds : bounds of the grades (None for all the grades)
+        :return: list of all the grades, or a grade summary in histogram mode
+        """
+        tasks_id = self._get_filtered_ids(tasks, exec_list, tag_list)
+
+        stats_exec = self._tasks_stats(courseid, tasks, daterange, grade_bounds)
+        _logger.debug("Statistics of %d exercises", len(stats_exec))
+        if tasks_id is None:
+            all_result = stats_exec
+        else:
+            selected = set(tasks_id)
+            all_result = [task for task in stats_exec if task["_id"] in selected]
 
         if len(all_result) == 0:
             return None
 
+        if self._use_histograms():
+            return aggregate_grade_summaries(all_result)
         return aggregate_all_grades(all_result)
 
-    def _get_best_distribution(self, courseid, tasks, daterange, exec_list, tag_list):
+    def _get_tag_sorted(self, courseid, tasks, daterange, tag_list, grade_bounds=None):
+        """
+        Get the statistics per tag of the submissions of tags {tag_list} (all the tags if empty)
+        :return: dict mapping each tag to its statistics (see `tags_stats_from_tasks`)
+        """
+        stats_tags = self._tags_stats(courseid, tasks, daterange, grade_bounds)
+        _logger.debug("Statistics of %d tags", len(stats_tags))
+        if len(tag_list) == 0:
+            return stats_tags
+        return {tag: stats_tags[tag] for tag in tag_list if tag in stats_tags}
+
+    def _get_best_distribution(self, courseid, tasks, daterange, exec_list, tag_list, grade_bounds=None):
         #TODO doc
-        tasks_id = self._get_ids_from_name(tasks, exec_list)
+        tasks_id = self._get_filtered_ids(tasks, exec_list, tag_list)
 
-        best = self._get_best_submissions(courseid, tasks, tasks_id, daterange)
+        best = self._get_best_submissions(courseid, tasks, tasks_id, daterange, grade_bounds)
         result = []
         for submission in best:
             result.append(submission["grade"])
         return result
 
-    def _get_before_perfect(self, courseid, tasks, daterange, exec_list, grade_bounds):
+    def _get_classrooms(self, courseid):
+        """ Returns a dict mapping each student of the course to the description of their classroom (or team) """
+        classrooms = {}
+        for aggregation in self._stats_database.aggregations.find({"courseid": courseid}, {"description": 1, "students": 1}):
+            for username in aggregation.get("students", []):
+                classrooms[username] = aggregation["description"]
+        return classrooms
+
+    def _get_grouped_distribution(self, courseid, tasks, daterange, exec_list, tag_list, grade_bounds, group_by, best=False):
+        """
+        Get the grades of the submissions of tags {tag_list} and exercises {exec_list},
+        counted by the database per group {group_by} (see GROUP_BY_OPTIONS) and
+        histogram bucket, in a single aggregation. The rows of a task are
+        counted in each of its tags (only the tags {tag_list}, if not empty).
+        :return: a tuple (list of the group of each row, list of rows of `grouped_grades_pipeline`)
+        """
+        tasks_id = self._get_filtered_ids(tasks, exec_list, tag_list)
+        match = submissions_match(courseid, daterange, tasks_id, grade_bounds)
+        rows = list(self._stats_database.submissions.aggregate(
+            grouped_grades_pipeline(match, group_by, best), allowDiskUse=True))
+
+        if group_by == "tag":
+            tag_rows = [(tag, row) for row in rows for tag in tasks.get_tags(row["_id"]["key"])
+                        if tag != "" and (len(tag_list) == 0 or tag in tag_list)]
+            return [tag for (tag, __) in tag_rows], [row for (__, row) in tag_rows]
+
+        keys = [row["_id"]["key"] for row in rows]
+        if group_by == "task":
+            language = self._session_language()
+            keys = [tasks.get_name(taskid, language) for taskid in keys]
+        elif group_by == "classroom":
+            classrooms = self._get_classrooms(courseid)
+            keys = [classrooms.get(username, "-") for username in keys]
+        return keys, rows
+
+    def _get_before_perfect(self, courseid, tasks, daterange, exec_list, tag_list, grade_bounds):
         #TODO doc
-        tasks_id = self._get_ids_from_name(tasks, exec_list)
+        tasks_id = self._get_filtered_ids(tasks, exec_list, tag_list)
         data = self._get_task_failed_attempts(courseid, tasks_id, daterange, grade_bounds)
         return data
 
-    def _get_submissions_per_time(self, courseid, tasks, daterange, exec_list, grade_bounds):
+    def _get_submissions_per_time(self, courseid, tasks, daterange, exec_list, tag_list, grade_bounds,
+                                  time_options=("day", None)):
         #TODO doc
-        tasks_id = self._get_ids_from_name(tasks, exec_list)
-        data = self._get_submissions_by_time(courseid, tasks_id, daterange, grade_bounds)
+        tasks_id = self._get_filtered_ids(tasks, exec_list, tag_list)
+        (granularity, timezone) = time_options
+        data = self._get_submissions_by_time(courseid, tasks_id, daterange, grade_bounds, granularity, timezone)
         return data
 
     def _get_ids_from_name(self, tasks, exec_list):
-        all_tasks_id = []
-        for t in tasks:
-            if tasks[t]._name.strip() in exec_list:
-                all_tasks_id.append(tasks[t].get_id())
-        return all_tasks_id
+        """
+        Returns the ids of the tasks named in {exec_list} (names ending with "*" are prefixes),
+        from the index of the tasks {tasks} (see `TaskIndex`), or None (all the tasks) if
+        {exec_list} is empty. If no task has these names, the list is empty: the queries
+        filtered with it match no submission.
+        """
+        if len(exec_list) == 0:
+            return None
+        return tasks.ids_from_names(exec_list)
+
+    def _get_filtered_ids(self, tasks, exec_list, tag_list):
+        """
+        Returns the ids of the tasks named in {exec_list} (see `_get_ids_from_name`)
+        having one of the tags {tag_list} in their descriptor, or None (all the tasks)
+        if there is no filter.
+        """
+        tasks_id = self._get_ids_from_name(tasks, exec_list)
+        if len(tag_list) == 0:
+            return tasks_id
+        with_tags = tasks.ids_with_tags(tag_list)
+        if tasks_id is None:
+            return sorted(with_tags)
+        return [taskid for taskid in tasks_id if taskid in with_tags]
 
     def GET_AUTH(self, courseid, f=None, t=None):
         """ GET Request """
         # TODO no idea what f and t are
         course, __ = self.get_course_and_check_rights(courseid)
-        return self.template_helper.get_custom_renderer(os.path.join(PATH_TO_PLUGIN, 'templates')).adv_stats(course, None, None)
+        return self.template_helper.get_custom_renderer(os.path.join(PATH_TO_PLUGIN, 'templates')).adv_stats(course, None, RESULT_CACHE.get_stats())
 
-    def POST_AUTH(self, courseid):
-        """POST Request"""
-        print("=============>> POST was called")
-        course, __ = self.get_course_and_check_rights(courseid)
-        tasks = course.get_tasks()
-
-        chart_query = web.input(stats_from='', stats_to='', chart_type='', submissions_filter='', max_submission_grade='', min_submission_grade='', filter_tags='', filter_exercises='')
-
-        (chart_type, daterange, exercises, tags, grade_bounds, all_or_best_submissions) = parse_query(chart_query)
-        print("QUERY: " + str((chart_type, daterange, exercises, tags, grade_bounds, all_or_best_submissions)))
-        (minimum, maximum) = grade_bounds
-        chart_query.min_submission_grade = minimum
-        chart_query.max_submission_grade = maximum
+    def _compute_statistics(self, courseid, course, parsed_query, time_options=("day", None), group_by=None):
+        """
+        Computes the statistics for the chart described by `parsed_query`
+        (as returned by `parse_query`), `time_options` (as returned by
+        `parse_time_options`) and `group_by` (as returned by `parse_group_by`).
+        The time spent is added to the phases of `self._profile`.
+        :return: dict containing the statistics and the data to plot, or None
+        """
+        (chart_type, daterange, exercises, tags, grade_bounds, all_or_best_submissions) = parsed_query
+        profile = self._profile
 
         data = None
         statistics = None
 
-        if chart_type == "grades-distribution":
-            if all_or_best_submissions == "all":
-                data = self._get_all_distribution(courseid, tasks, daterange, exercises, tags)
-            else:  # "best
-                data = self._get_best_distribution(courseid, tasks, daterange, exercises, tags)
-
-            if data is not None:
-                # all_grades = aggregate_all_grades(data)
-                all_grades = apply_grade_filter(data, grade_bounds)
-                statistics = compute_advanced_stats(all_grades)
-                if statistics is not None:
-                    statistics["raw_data"] = all_grades
+        if chart_type == "grades-distribution" and group_by is not None:
+            with profile.span("post-processing"):
+                (keys, rows) = self._get_grouped_distribution(courseid, TASK_INDEX.get(course), daterange, exercises,
+                                                              tags, grade_bounds, group_by,
+                                                              all_or_best_submissions == "best")
+            with profile.span("stats"):
+                if len(rows) > 0:
+                    (groups, matrix, summary) = compute_grouped_stats(
+                        keys, [row["_id"]["bin"] for row in rows], [row["count"] for row in rows],
+                        [row["sum"] for row in rows], [row["sum_squares"] for row in rows],
+                        [row["min"] for row in rows], [row["max"] for row in rows])
+                    # The table shows the statistics of all the groups together
+                    statistics = compute_advanced_stats(summary)
+                    statistics["raw_data"] = []
+                    statistics["histogram"] = summary["histogram"]
+                    statistics["groups"] = {"by": group_by, "labels": groups, "columns": GROUP_STATS, "matrix": matrix}
+            _logger.debug("Grades distribution of %d groups", len(statistics["groups"]["labels"]) if statistics else 0)
+
+        elif chart_type == "grades-distribution":
+            with profile.span("post-processing"):
+                tasks = TASK_INDEX.get(course)
+                if all_or_best_submissions == "all":
+                    data = self._get_all_distribution(courseid, tasks, daterange, exercises, tags, grade_bounds)
+                else:  # "best
+                    data = self._get_best_distribution(courseid, tasks, daterange, exercises, tags, grade_bounds)
+
+            # The grade bounds are applied by the database
+            with profile.span("stats"):
+                if isinstance(data, dict):  # histogram mode
+                    statistics = compute_advanced_stats(data)
+                    if statistics is not None:
+                        statistics["raw_data"] = []
+                        statistics["histogram"] = data["histogram"]
+                elif data is not None:
+                    statistics = compute_advanced_stats(data)
+                    if statistics is not None:
+                        statistics["raw_data"] = data
 
         elif chart_type == "submission-before-perfect":
-            data = self._get_before_perfect(courseid, tasks, daterange, exercises, grade_bounds)
-            if data is not None:
-                all_tries = process_nb_attempts_dict(data)
-                statistics = compute_advanced_stats(all_tries)
+            with profile.span("post-processing"):
+                data = self._get_before_perfect(courseid, TASK_INDEX.get(course), daterange, exercises, tags,
+                                                grade_bounds)
+            with profile.span("stats"):
+                if data is not None:
+                    all_tries = process_nb_attempts_dict(data)
+                    statistics = compute_advanced_stats(all_tries)
+                    if statistics is not None:
+                        statistics["raw_data"] = all_tries
+
+        elif chart_type == "lines-per-submission":
+            with profile.span("post-processing"):
+                tasks_id = self._get_filtered_ids(TASK_INDEX.get(course), exercises, tags)
+                data = self._get_lines_distribution(courseid, tasks_id, daterange, grade_bounds)
+            with profile.span("stats"):
+                all_lines = process_nb_attempts_dict(data)
+                statistics = compute_advanced_stats(all_lines)
+                if statistics is not None:
+                    statistics["raw_data"] = all_lines
+
+        elif chart_type == "tag-sorted":
+            with profile.span("post-processing"):
+                data = self._get_tag_sorted(courseid, TASK_INDEX.get(course), daterange, tags, grade_bounds)
+            with profile.span("stats"):
+                labels = sorted(data, key=lambda tag: data[tag]["submissions"], reverse=True)
+                grades = GradeAccumulator()
+                for tag in labels:
+                    grades.merge(data[tag]["grades"])
+                # Statistics of the grades of the submissions of the tags (counted once per tag)
+                statistics = compute_advanced_stats(grades.to_summary())
                 if statistics is not None:
-                    statistics["raw_data"] = all_tries
+                    statistics["raw_data"] = [data[tag]["submissions"] for tag in labels]
+                    statistics["labels"] = labels
 
         elif chart_type == "submissions-time":
-            (times, nb_submissions_per_time) = self._get_submissions_per_time(courseid, tasks, daterange, exercises, grade_bounds)
-            statistics = compute_temporal_advanced_stats(nb_submissions_per_time)
-            statistics["raw_data"] = nb_submissions_per_time
-            statistics["times"] = times
-            print("TIMES: " + str(times))
-            print("NB: " + str(nb_submissions_per_time))
-
-        if "times" not in statistics:
-            statistics["times"] = []  # Placeholder
-        print("DB RETURNED")
-        print(data)
-        print("FINALLY: " + str(statistics))
+            with profile.span("post-processing"):
+                (times, nb_submissions_per_time) = self._get_submissions_per_time(courseid, TASK_INDEX.get(course), daterange, exercises, tags, grade_bounds, time_options)
+            with profile.span("stats"):
+                statistics = compute_temporal_advanced_stats(nb_submissions_per_time)
+                if statistics is not None:
+                    statistics["raw_data"] = nb_submissions_per_time
+                    statistics["times"] = times
+            _logger.debug("Submissions timeline with %d points", len(times))
+
+        if statistics is not None:
+            statistics.setdefault("times", [])  # Placeholder
+            statistics.setdefault("histogram", [])
+        _logger.debug("Chart %s of course %s: %d documents (%d bytes) received from the database",
+                      chart_type, courseid, self._transfer.documents, self._transfer.bytes)
+        return statistics
+
+    @staticmethod
+    def _get_chart_query():
+        """
+        Returns the query for a chart sent by the user (with the grade bounds
+        normalized), its parsed version (see `parse_query`), its time
+        options (see `parse_time_options`) and its groups (see `parse_group_by`).
+        """
+        chart_query = web.input(stats_from='', stats_to='', chart_type='', submissions_filter='', max_submission_grade='', min_submission_grade='', filter_tags='', filter_exercises='', time_granularity='day', timezone='', group_by='')
 
+        parsed_query = parse_query(chart_query)
+        time_options = parse_time_options(chart_query)
+        group_by = parse_group_by(chart_query)
+        (minimum, maximum) = parsed_query[4]
+        chart_query.min_submission_grade = minimum
+        chart_query.max_submission_grade = maximum
+        return chart_query, parsed_query, time_options, group_by
+
+    def _get_statistics(self, courseid, course, parsed_query, time_options, group_by=None):
+        """
+        Returns the statistics for the chart described by `parsed_query`,
+        `time_options` and `group_by`, from the cache if possible.
+        """
+        _logger.debug("Query for course %s: %s %s %s", courseid, parsed_query, time_options, group_by)
+        self._profile = RequestProfile(courseid, parsed_query[0])
+
+        key = self._statistics_key(parsed_query, time_options, group_by)
+        (cached, statistics) = RESULT_CACHE.get(courseid, key)
+        if not cached:
+            statistics = self._compute_statistics(courseid, course, parsed_query, time_options, group_by)
+            RESULT_CACHE.put(courseid, key, statistics)
+        self._profile.cached = cached
+        self._profile.documents = self._transfer.documents
+        self._profile.bytes = self._transfer.bytes
+        return statistics
+
+    @classmethod
+    def _statistics_key(cls, parsed_query, time_options, group_by=None):
+        """ Returns the key of the statistics of a chart in the cache """
+        # The end of the date range defaults to the current hour, so that
+        # identical queries share the same key for up to an hour
+        return query_key(parsed_query) + (time_options, group_by, cls._use_histograms())
+
+    def _record_profile(self, start):
+        """ Records the profile of the request, which started at `start` """
+        self._profile.add("total", time.perf_counter() - start)
+        PROFILE_HISTORY.record(self._profile)
+        _logger.info("Chart %s of course %s computed in %.1f ms (cached: %s)", self._profile.chart_type,
+                     self._profile.courseid, self._profile.phases["total"] * 1000, self._profile.cached)
+
+    def POST_AUTH(self, courseid):
+        """
+        POST Request: the page is returned with the filters of the chart,
+        whose data is then loaded from `AdvancedCourseStatisticApiPage`.
+        """
+        course, __ = self.get_course_and_check_rights(courseid)
+        (chart_query, __, __, __) = self._get_chart_query()
+        return self.template_helper.get_custom_renderer(os.path.join(PATH_TO_PLUGIN, 'templates')).adv_stats(course, chart_query, RESULT_CACHE.get_stats())
+
+
+class AdvancedCourseStatisticApiPage(AdvancedCourseStatisticClass):
+    """
+    JSON API returning the statistics of a chart. With the `binned` parameter,
+    the bars to plot are returned (keys "bars" and "labels") instead of the raw data.
+    """
+
+    def GET_AUTH(self, courseid):  # pylint: disable=arguments-differ
+        """ GET Request """
+        return self.POST_AUTH(courseid)
+
+    def POST_AUTH(self, courseid):
+        """
+        POST Request. The charts of BACKGROUND_CHARTS that are not in the cache
+        are computed by a job: its id is returned (key "job"), and its result
+        is then polled from `AdvancedCourseStatisticJobPage`.
+        """
+        start = time.perf_counter()
         course, __ = self.get_course_and_check_rights(courseid)
-        return self.template_helper.get_custom_renderer(os.path.join(PATH_TO_PLUGIN, 'templates')).adv_stats(course, chart_query, statistics)
+        (chart_query, parsed_query, time_options, group_by) = self._get_chart_query()
+        binned = web.input(binned='').binned not in ('', '0', 'false')
+        web.header('Content-Type', 'application/json')
+
+        key = self._statistics_key(parsed_query, time_options, group_by)
+        if JOB_QUEUE.enabled and parsed_query[0] in PLUGIN_CONFIG.get("background_charts", BACKGROUND_CHARTS) \
+                and not RESULT_CACHE.contains(courseid, key):
+            job = self._submit_job(courseid, course, chart_query, parsed_query, time_options, group_by, binned)
+            return json.dumps({"query": dict(chart_query), "job": job})
+        return self._get_response(courseid, course, chart_query, parsed_query, time_options, group_by, binned, start)
+
+    def _submit_job(self, courseid, course, chart_query, parsed_query, time_options, group_by, binned):
+        """
+        Submits the job computing the response of `_get_response` in the
+        background, and returns its id. The language of the session and the
+        database are read now, on the thread of the request.
+        """
+        self._session_language()
+        self._session_database()
+        key = self._statistics_key(parsed_query, time_options, group_by) + (binned,)
+        return JOB_QUEUE.submit(courseid, key, lambda: self._get_response(
+            courseid, course, chart_query, parsed_query, time_options, group_by, binned, time.perf_counter()))
+
+    def _get_response(self, courseid, course, chart_query, parsed_query, time_options, group_by, binned, start):
+        """ Returns the JSON response with the statistics of the chart """
+        statistics = self._get_statistics(courseid, course, parsed_query, time_options, group_by)
+        with self._profile.span("render"):
+            result = {"query": dict(chart_query), "statistics": None, "cache": RESULT_CACHE.get_stats()}
+            if statistics is not None:
+                result["statistics"] = dict(statistics)
+                if binned:
+                    result["statistics"].update(bin_chart_data(parsed_query[0], statistics, parsed_query[4]))
+                    result["statistics"]["raw_data"] = []
+                    result["statistics"]["histogram"] = []
+            result["profile"] = self._profile.to_dict()
+            response = json.dumps(result, default=json_default)
+        self._record_profile(start)
+        return response
+
+
+class AdvancedCourseStatisticExportPage(AdvancedCourseStatisticClass):
+    """
+    Streaming export of the submissions ("submissions"), statistics per task
+    ("tasks") or attempts before success ("attempts") matching the filters
+    of a chart, as CSV or Parquet (requires pyarrow).
+    """
+
+    def GET_AUTH(self, courseid):  # pylint: disable=arguments-differ
+        """ GET Request """
+        return self.POST_AUTH(courseid)
+
+    def POST_AUTH(self, courseid):
+        """ POST Request """
+        course, __ = self.get_course_and_check_rights(courseid)
+        (__, parsed_query, __, __) = self._get_chart_query()
+        (__, daterange, exercises, tags, grade_bounds, __) = parsed_query
+        options = web.input(export="submissions", format="csv")
+        if options.format not in export.FORMATS or options.export not in ("submissions", "tasks", "attempts"):
+            raise web.badrequest()
+        if options.format == "parquet" and not export.parquet_available():
+            raise web.badrequest("Parquet export requires pyarrow")
+
+        tasks = TASK_INDEX.get(course)
+        tasks_id = self._get_filtered_ids(tasks, exercises, tags)
+        if options.export == "submissions":
+            columns, types = export.SUBMISSIONS_COLUMNS, export.SUBMISSIONS_TYPES
+            rows = export.submission_rows(self.database, courseid, daterange, tasks_id, grade_bounds)
+        elif options.export == "tasks":
+            columns, types = export.TASKS_COLUMNS, export.TASKS_TYPES
+            # The histogram rows have the same counters without all the grades of the course
+            stats_tasks = self._compute_tasks_histograms(courseid, tasks, daterange, grade_bounds)
+            rows = export.task_rows(task for task in stats_tasks if tasks_id is None or task["_id"] in tasks_id)
+        else:
+            columns, types = export.ATTEMPTS_COLUMNS, export.ATTEMPTS_TYPES
+            rows = export.attempt_rows(self.database, courseid, daterange, tasks_id, grade_bounds)
+
+        (content_type, extension) = export.FORMATS[options.format]
+        web.header('Content-Type', content_type)
+        web.header('Content-Disposition', 'attachment; filename="{}-{}.{}"'.format(courseid, options.export, extension))
+        if options.format == "parquet":
+            return export.parquet_stream(columns, types, rows)
+        return export.csv_stream(columns, rows)
+
+
+class AdvancedCourseStatisticJobPage(INGIniousAdminPage):
+    """
+    Status of a job computing a chart in the background: {"status": ...}, with the
+    response of `AdvancedCourseStatisticApiPage` (key "result") once it is done.
+    """
+
+    def GET_AUTH(self, courseid, jobid):  # pylint: disable=arguments-differ
+        """ GET Request """
+        self.get_course_and_check_rights(courseid)
+        job = JOB_QUEUE.get(courseid, jobid)
+        if job is None:
+            raise web.notfound()
+        web.header('Content-Type', 'application/json')
+        if job["status"] == jobs.DONE:
+            # The result is already serialized
+            return '{{"status": "{}", "result": {}}}'.format(jobs.DONE, job["result"])
+        return json.dumps({"status": job["status"], "error": job.get("error")})
+
+
+class AdvancedCourseStatisticDebugPage(INGIniousAdminPage):
+    """ JSON list of the timings of the last requests to the statistics page of a course """
+
+    def GET_AUTH(self, courseid):  # pylint: disable=arguments-differ
+        """ GET Request """
+        self.get_course_and_check_rights(courseid)
+        web.header('Content-Type', 'application/json')
+        return json.dumps(PROFILE_HISTORY.get_profiles(courseid))
+
+
+def create_indexes(database):
+    """ Creates the indexes used by the statistics queries """
+    database.submissions.create_index([("courseid", 1), ("taskid", 1), ("submitted_on", 1)], background=True)
+    database.submissions.create_index([("courseid", 1), ("submitted_on", 1)], background=True)
+    rollups.ensure_indexes(database)
+    jobs.ensure_indexes(database)
+    metrics.ensure_indexes(database)
+
+
+def on_submission_done(database, submission):
+    """ Hook called when a submission is completed """
+    RESULT_CACHE.invalidate_course(submission["courseid"])
+    JOB_QUEUE.invalidate_course(submission["courseid"])
+    rollups.on_submission_done(database, submission)
+    metrics.on_submission_done(database, submission)
 
 
 def init(plugin_manager, course_factory, client, plugin_config):  # pylint: disable=unused-argument
     """ Init the plugin """
+    PLUGIN_CONFIG.update(plugin_config)
+    RESULT_CACHE.configure(plugin_config.get("cache_size", 128), plugin_config.get("cache_ttl", 300))
+    PROFILE_HISTORY.configure(plugin_config.get("profile_history", 50))
+    database = plugin_manager.get_database()
+    create_indexes(database)
+    JOB_QUEUE.configure(database, plugin_config.get("background_workers", 2), plugin_config.get("cache_ttl", 300))
+    plugin_manager.add_hook('submission_done',
+                            lambda submission, archive, newsub: on_submission_done(database, submission))
     plugin_manager.add_page('/admin/([^/]+)/adv_stats', AdvancedCourseStatisticClass)
+    plugin_manager.add_page('/admin/([^/]+)/adv_stats/debug', AdvancedCourseStatisticDebugPage)
+    plugin_manager.add_page('/admin/([^/]+)/adv_stats/api', AdvancedCourseStatisticApiPage)
+    plugin_manager.add_page('/admin/([^/]+)/adv_stats/api/jobs/([0-9a-f]+)', AdvancedCourseStatisticJobPage)
+    plugin_manager.add_page('/admin/([^/]+)/adv_stats/export', AdvancedCourseStatisticExportPage)
     plugin_manager.add_hook('course_admin_menu', add_admin_menu)
     plugin_manager.add_page('/plugins/stats/static/(.+)', StaticMockPage)
     plugin_manager.add_hook('css', lambda: '/plugins/stats/static/adv_stats.css')
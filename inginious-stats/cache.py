@@ -0,0 +1,90 @@
+"""
+Plugin for INGInious released under AGPL-3.0
+Created by a team at OpenWeek2019
+Florian Damhaut, Céline Deknop, Simon Gustin and Maxime Mawait
+
+Cache of the statistics computed for the charts.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultCache(object):
+    """
+    Bounded LRU cache whose entries expire after `ttl` seconds.
+    Each entry belongs to a course, so that all the entries of a course can
+    be invalidated when a new submission is made for it.
+    The cache is local to the webapp process: other processes only see new
+    submissions once their entries expire.
+    """
+
+    def __init__(self, max_size=128, ttl=300):
+        self._entries = OrderedDict()  # key -> (expiration time, courseid, value)
+        self._lock = threading.Lock()
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def configure(self, max_size, ttl):
+        """ Changes the size and time to live of the cache, and empties it. """
+        with self._lock:
+            self.max_size = max_size
+            self.ttl = ttl
+            self._entries.clear()
+
+    def get(self, courseid, key):
+        """
+        Returns a tuple (True, value) if `key` is in the cache for the course
+        `courseid` and not expired, (False, None) otherwise.
+        """
+        with self._lock:
+            entry = self._entries.get((courseid, key))
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[(courseid, key)]
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end((courseid, key))
+            self.hits += 1
+            return True, entry[2]
+
+    def contains(self, courseid, key):
+        """ Returns True if `key` is in the cache for the course `courseid` and not expired (not counted as a hit). """
+        with self._lock:
+            entry = self._entries.get((courseid, key))
+            return entry is not None and entry[0] >= time.monotonic()
+
+    def put(self, courseid, key, value):
+        """ Adds `value` to the cache, evicting the least recently used entries if the cache is full. """
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[(courseid, key)] = (time.monotonic() + self.ttl, courseid, value)
+            self._entries.move_to_end((courseid, key))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate_course(self, courseid):
+        """ Removes all the entries of the course `courseid`. """
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if entry[1] == courseid]:
+                del self._entries[key]
+
+    def get_stats(self):
+        """ Returns a dict with the number of hits, misses and entries of the cache. """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+def query_key(parsed_query):
+    """
+    Returns a hashable key for the tuple returned by `parse_query`.
+    The lists of exercises and tags are sorted, as their order does not
+    change the result.
+    """
+    (chart_type, daterange, exercises, tags, grade_bounds, submissions_filter) = parsed_query
+    return (chart_type, tuple(daterange), tuple(sorted(exercises)), tuple(sorted(tags)),
+            tuple(grade_bounds), submissions_filter)
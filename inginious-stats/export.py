@@ -0,0 +1,123 @@
+"""
+Plugin for INGInious released under AGPL-3.0
+Created by a team at OpenWeek2019
+Florian Damhaut, Céline Deknop, Simon Gustin and Maxime Mawait
+
+Streaming export of the submissions and statistics.
+Rows are read from MongoDB cursors and written by chunks, so that the
+memory used does not depend on the size of the course.
+"""
+
+import csv
+import io
+import tempfile
+
+from .queries import submissions_match
+from .rollups import attempts_pipeline
+
+# Number of rows written at once
+CHUNK_ROWS = 1000
+
+# Columns of each kind of export, and their types (for the columnar format)
+SUBMISSIONS_COLUMNS = ("id", "taskid", "username", "submitted_on", "grade", "result", "status")
+SUBMISSIONS_TYPES = ("string", "string", "string", "timestamp", "float", "string", "string")
+TASKS_COLUMNS = ("taskid", "name", "submissions", "validSubmissions", "averageGrade", "minGrade", "maxGrade")
+TASKS_TYPES = ("string", "string", "int", "int", "float", "float", "float")
+ATTEMPTS_COLUMNS = ("username", "taskid", "attempts", "first_success")
+ATTEMPTS_TYPES = ("string", "string", "int", "timestamp")
+
+FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet")
+}
+
+
+def submission_rows(database, courseid, daterange, tasks_id, grade_bounds):
+    """
+    Yields a row (in the order of `SUBMISSIONS_COLUMNS`) for each submission
+    of the course matching the filters, oldest first.
+    """
+    match = submissions_match(courseid, daterange, tasks_id, grade_bounds)
+    projection = {"taskid": 1, "username": 1, "submitted_on": 1, "grade": 1, "result": 1, "status": 1}
+    cursor = database.submissions.find(match, projection).sort("submitted_on", 1).batch_size(CHUNK_ROWS)
+    for submission in cursor:
+        yield (str(submission["_id"]), submission["taskid"], ",".join(submission.get("username", [])),
+               submission["submitted_on"], submission.get("grade"), submission.get("result"),
+               submission.get("status"))
+
+
+def task_rows(stats_tasks):
+    """ Yields a row (in the order of `TASKS_COLUMNS`) for each dict returned by `_tasks_stats` """
+    for task in stats_tasks:
+        yield tuple(task[column] if column != "taskid" else task["_id"] for column in TASKS_COLUMNS)
+
+
+def attempt_rows(database, courseid, daterange, tasks_id, grade_bounds):
+    """
+    Yields a row (in the order of `ATTEMPTS_COLUMNS`) for each student and task:
+    the number of attempts before the first success and the date of this success.
+    """
+    rows = database.submissions.aggregate(
+        attempts_pipeline(submissions_match(courseid, daterange, tasks_id), grade_bounds), allowDiskUse=True)
+    for row in rows:
+        yield (row["_id"]["username"], row["_id"]["taskid"], row["attempts"], row["firstSuccess"])
+
+
+def csv_stream(columns, rows):
+    """ Yields the CSV file of the rows `rows`, by chunks of `CHUNK_ROWS` rows """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for index, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if index % CHUNK_ROWS == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+def parquet_stream(columns, types, rows, chunk_size=64 * 1024):
+    """
+    Yields the Parquet file of the rows `rows`, whose columns have the
+    types `types` ("string", "int", "float" or "timestamp"). The rows are
+    written by batches of `CHUNK_ROWS` to a temporary file, which is then
+    streamed. Requires pyarrow.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    arrow_types = {"string": pa.string(), "int": pa.int64(), "float": pa.float64(), "timestamp": pa.timestamp("ms")}
+    schema = pa.schema([(column, arrow_types[column_type]) for (column, column_type) in zip(columns, types)])
+
+    with tempfile.TemporaryFile() as output:
+        writer = pq.ParquetWriter(output, schema)
+        batch = []
+
+        def write_batch():
+            arrays = [pa.array([row[i] for row in batch], type=schema.types[i]) for i in range(len(columns))]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+
+        for row in rows:
+            batch.append(row)
+            if len(batch) == CHUNK_ROWS:
+                write_batch()
+                batch = []
+        if batch:
+            write_batch()
+        writer.close()
+
+        output.seek(0)
+        chunk = output.read(chunk_size)
+        while chunk:
+            yield chunk
+            chunk = output.read(chunk_size)
+
+
+def parquet_available():
+    """ Returns True if pyarrow is installed """
+    try:
+        import pyarrow.parquet  # pylint: disable=unused-import
+        return True
+    except ImportError:
+        return False
@@ -0,0 +1,132 @@
+"""
+Plugin for INGInious released under AGPL-3.0
+Created by a team at OpenWeek2019
+Florian Damhaut, Céline Deknop, Simon Gustin and Maxime Mawait
+
+Background computation of the charts that are too slow for a web request.
+
+The charts are computed by a thread pool of the webapp process. Each job is
+identified by the hash of its query and stored in the `adv_stats_jobs`
+collection, with its status and (once done) its JSON result: identical
+requests, from this process or another one, share the same job instead of
+computing the chart again.
+"""
+
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from pymongo.errors import DuplicateKeyError
+
+JOBS = "adv_stats_jobs"
+
+# Statuses of a job
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Time after which a job that did not complete is considered to have crashed
+JOB_TIMEOUT = timedelta(minutes=30)
+
+# Time after which the jobs are removed from the database
+JOB_EXPIRATION = timedelta(days=1)
+
+_logger = logging.getLogger("inginious.webapp.plugins.adv_stats")
+
+
+def job_id(courseid, key):
+    """ Returns the id of the job computing the chart of the course `courseid` with the cache key `key` """
+    return hashlib.sha1(repr((courseid, key)).encode("utf-8")).hexdigest()
+
+
+def ensure_indexes(database):
+    """ Creates the indexes of the jobs collection. """
+    database[JOBS].create_index("courseid")
+    database[JOBS].create_index("updated", expireAfterSeconds=int(JOB_EXPIRATION.total_seconds()))
+
+
+class JobQueue(object):
+    """
+    Runs the jobs in a pool of `workers` threads, and stores their status
+    and result in the database. The results are reused for `ttl` seconds,
+    or until a submission of the course is completed.
+    """
+
+    def __init__(self, workers=2, ttl=300):
+        self._database = None
+        self._executor = None
+        self._lock = threading.Lock()
+        self.workers = workers
+        self.ttl = ttl
+
+    def configure(self, database, workers, ttl):
+        """ Sets the database and the number of threads (0 to disable the jobs) and time to live of the results """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+            self._database = database
+            self._executor = ThreadPoolExecutor(max_workers=workers) if workers > 0 else None
+            self.workers = workers
+            self.ttl = ttl
+
+    @property
+    def enabled(self):
+        """ True if the jobs can be run """
+        return self._executor is not None
+
+    def submit(self, courseid, key, compute):
+        """
+        Returns the id of the job computing the chart of the course `courseid`
+        with the cache key `key`. The function `compute`, returning the
+        result of the job as a JSON string, is only run if there is no job
+        for this chart which is done (and not expired) or still running.
+        """
+        identifier = job_id(courseid, key)
+        now = datetime.utcnow()
+        try:
+            self._database[JOBS].insert_one({"_id": identifier, "courseid": courseid, "status": PENDING,
+                                             "created": now, "updated": now})
+            claimed = True
+        except DuplicateKeyError:
+            # Rerun the job if it failed, expired or crashed
+            claimed = self._database[JOBS].find_one_and_update(
+                {"_id": identifier, "$or": [
+                    {"status": FAILED},
+                    {"status": DONE, "updated": {"$lt": now - timedelta(seconds=self.ttl)}},
+                    {"status": {"$in": [PENDING, RUNNING]}, "updated": {"$lt": now - JOB_TIMEOUT}}]},
+                {"$set": {"status": PENDING, "created": now, "updated": now},
+                 "$unset": {"result": "", "error": ""}}) is not None
+
+        if claimed:
+            self._executor.submit(self._run, identifier, compute)
+        return identifier
+
+    def _run(self, identifier, compute):
+        """
+        Runs the job `identifier`, storing its result or error. Failing to
+        store the result (e.g. larger than a MongoDB document) fails the job.
+        """
+        try:
+            self._database[JOBS].update_one({"_id": identifier}, {"$set": {
+                "status": RUNNING, "updated": datetime.utcnow()}})
+            result = compute()
+            self._database[JOBS].update_one({"_id": identifier}, {"$set": {
+                "status": DONE, "result": result, "updated": datetime.utcnow()}})
+        except Exception as error:  # pylint: disable=broad-except
+            _logger.exception("Job %s failed", identifier)
+            self._database[JOBS].update_one({"_id": identifier}, {"$set": {
+                "status": FAILED, "error": str(error), "updated": datetime.utcnow()},
+                "$unset": {"result": ""}})
+
+    def get(self, courseid, identifier):
+        """ Returns the job `identifier` of the course `courseid` (status, result or error), or None """
+        return self._database[JOBS].find_one({"_id": identifier, "courseid": courseid},
+                                             {"status": 1, "result": 1, "error": 1})
+
+    def invalidate_course(self, courseid):
+        """ Removes the results of the jobs of the course `courseid` """
+        if self._database is not None:
+            self._database[JOBS].delete_many({"courseid": courseid, "status": {"$in": [DONE, FAILED]}})
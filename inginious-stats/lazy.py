@@ -0,0 +1,37 @@
+"""
+Plugin for INGInious released under AGPL-3.0
+Created by a team at OpenWeek2019
+Florian Damhaut, Céline Deknop, Simon Gustin and Maxime Mawait
+
+Lazy import of the heavy dependencies of the statistics.
+"""
+
+import importlib
+import threading
+
+
+class LazyModule(object):
+    """
+    Stands for the module `name`, which is only imported the first time one
+    of its attributes is accessed. The webapp workers that never compute
+    statistics thus do not pay its import time and memory.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        """ Imports the module (once) and returns it """
+        with self._lock:
+            if self._module is None:
+                self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attribute):
+        module = self._module if self._module is not None else self._load()
+        return getattr(module, attribute)
+
+    def __repr__(self):
+        return "<lazy module {!r}{}>".format(self._name, "" if self._module is not None else " (not loaded)")
@@ -0,0 +1,181 @@
+"""
+Plugin for INGInious released under AGPL-3.0
+Created by a team at OpenWeek2019
+Florian Damhaut, Céline Deknop, Simon Gustin and Maxime Mawait
+
+Cheap code metrics of the submissions (number of lines, ...).
+
+Computing them requires the input of the submission, which is stored in
+GridFS, so they are computed once per submission and stored in the
+`adv_stats_metrics` collection with the fields used by the filters of the
+charts: the charts then aggregate the metrics only.
+
+The metrics of a submission are computed when it is completed (see
+`on_submission_done`). Those of existing submissions are computed, in
+batches by a pool of processes, with:
+
+    python3 -m inginious-stats.metrics --host mongodb://localhost --database INGInious [courseid ...]
+"""
+
+import argparse
+import logging
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+import bson
+import gridfs
+from bson.errors import BSONError
+from gridfs.errors import NoFile
+from pymongo import ReplaceOne
+
+METRICS = "adv_stats_metrics"
+
+# Fields of the submissions copied with the metrics, to filter them as the submissions
+SUBMISSION_FIELDS = ("courseid", "taskid", "username", "submitted_on", "grade", "result")
+
+# Number of submissions processed by each task of the backfill
+BATCH_SIZE = 500
+
+_logger = logging.getLogger("inginious.webapp.plugins.adv_stats")
+
+# Thread computing the metrics of the completed submissions, created on first use
+_executor = None
+
+
+def ensure_indexes(database):
+    """ Creates the indexes of the metrics collection. """
+    database[METRICS].create_index([("courseid", 1), ("taskid", 1), ("submitted_on", 1)])
+    database[METRICS].create_index([("courseid", 1), ("submitted_on", 1)])
+
+
+def input_metrics(inputdata):
+    """
+    Returns the metrics of the input `inputdata` of a submission (dict mapping
+    each problem to its answer): number of lines, non-blank lines and
+    characters of the textual answers (code), and number of such answers.
+    """
+    lines = 0
+    non_blank_lines = 0
+    characters = 0
+    answers = 0
+    for (problem, answer) in inputdata.items():
+        if problem.startswith("@"):  # language, random inputs, state, ...
+            continue
+        if isinstance(answer, dict) and isinstance(answer.get("value"), bytes):  # uploaded file
+            answer = answer["value"].decode("utf-8", errors="replace")
+        if not isinstance(answer, str):  # multiple choice, match, ...
+            continue
+        answer_lines = answer.splitlines()
+        answers += 1
+        lines += len(answer_lines)
+        non_blank_lines += sum(1 for line in answer_lines if line.strip() != "")
+        characters += len(answer)
+    return {"lines": lines, "non_blank_lines": non_blank_lines, "characters": characters, "answers": answers}
+
+
+def load_input(database, submission, fs=None):
+    """ Returns the input of the submission `submission`, stored in GridFS or in the submission """
+    inputdata = submission.get("input", {})
+    if isinstance(inputdata, dict):
+        return inputdata
+    fs = fs if fs is not None else gridfs.GridFS(database)
+    return bson.BSON.decode(fs.get(inputdata).read())
+
+
+def submission_metrics(database, submission, fs=None):
+    """ Returns the document of the metrics of the submission `submission` """
+    document = {field: submission.get(field) for field in SUBMISSION_FIELDS}
+    document["_id"] = submission["_id"]
+    document.update(input_metrics(load_input(database, submission, fs)))
+    return document
+
+
+def store_metrics(database, submissions):
+    """ Computes and stores the metrics of the submissions `submissions`, returns their number """
+    fs = None  # only opened if an input is stored in GridFS
+    requests = []
+    for submission in submissions:
+        try:
+            if fs is None and not isinstance(submission.get("input", {}), dict):
+                fs = gridfs.GridFS(database)
+            document = submission_metrics(database, submission, fs)
+        except (NoFile, BSONError):
+            _logger.warning("Could not read the input of submission %s", submission["_id"])
+            continue
+        requests.append(ReplaceOne({"_id": document["_id"]}, document, upsert=True))
+    if requests:
+        database[METRICS].bulk_write(requests, ordered=False)
+    return len(requests)
+
+
+def on_submission_done(database, submission):
+    """
+    Hook called when a submission is completed: computes its metrics in a
+    background thread (submissions are processed one at a time).
+    """
+    global _executor  # pylint: disable=global-statement
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1)
+
+    def compute():
+        try:
+            store_metrics(database, [database.submissions.find_one({"_id": submission["_id"]})])
+        except Exception:  # pylint: disable=broad-except
+            _logger.exception("Could not compute the metrics of submission %s", submission["_id"])
+
+    _executor.submit(compute)
+
+
+# Database of the processes of the backfill, opened by `_init_worker`
+_worker_database = None
+
+
+def _init_worker(host, database_name):
+    """ Opens the connection of a process of the backfill (MongoClient cannot be shared across fork) """
+    global _worker_database  # pylint: disable=global-statement
+    import pymongo
+    _worker_database = pymongo.MongoClient(host)[database_name]
+
+
+def _backfill_batch(ids):
+    """ Computes the metrics of the submissions `ids`, in a process of the backfill """
+    projection = {field: 1 for field in SUBMISSION_FIELDS + ("input",)}
+    return store_metrics(_worker_database, _worker_database.submissions.find({"_id": {"$in": ids}}, projection))
+
+
+def missing_batches(database, courseid, batch_size=BATCH_SIZE):
+    """ Yields the ids of the submissions of the course `courseid` without metrics, by batches of `batch_size` """
+    done = set(x["_id"] for x in database[METRICS].find({"courseid": courseid}, {"_id": 1}))
+    batch = []
+    for submission in database.submissions.find({"courseid": courseid, "status": "done"}, {"_id": 1}):
+        if submission["_id"] not in done:
+            batch.append(submission["_id"])
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def main():
+    """ Computes the metrics of the submissions of existing courses. """
+    import pymongo
+
+    parser = argparse.ArgumentParser(description="Computes the code metrics of the submissions for the advanced statistics plugin.")
+    parser.add_argument("--host", default="localhost", help="MongoDB host (or URI)")
+    parser.add_argument("--database", default="INGInious", help="Name of the INGInious database")
+    parser.add_argument("--workers", type=int, default=None, help="Number of processes (number of CPUs by default)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Number of submissions per batch")
+    parser.add_argument("courseid", nargs="*", help="Courses to process (all by default)")
+    args = parser.parse_args()
+
+    database = pymongo.MongoClient(args.host)[args.database]
+    ensure_indexes(database)
+    with multiprocessing.Pool(args.workers, _init_worker, (args.host, args.database)) as pool:
+        for courseid in args.courseid or database.submissions.distinct("courseid"):
+            count = sum(pool.imap_unordered(_backfill_batch, missing_batches(database, courseid, args.batch_size)))
+            print("{}: metrics of {} submissions computed".format(courseid, count))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Plugin for INGInious released under AGPL-3.0
+Created by a team at OpenWeek2019
+Florian Damhaut, Céline Deknop, Simon Gustin and Maxime Mawait
+
+Timing of the phases of the requests to the statistics page.
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+# Phases measured by the database wrapper (see `queries.CountingDatabase`)
+DATABASE_PHASES = ("query", "transfer")
+
+
+class RequestProfile(object):
+    """
+    Time spent in each phase of a request: "query" (until the database
+    returns the first batch), "transfer" (iteration over the results),
+    "post-processing" (Python aggregation of the results), "stats",
+    "render" and "total". Explain plans of the queries can be attached.
+    """
+
+    def __init__(self, courseid, chart_type=None):
+        self.courseid = courseid
+        self.chart_type = chart_type
+        self.date = datetime.now()
+        self.phases = {}
+        self.explains = []
+        self.documents = 0
+        self.bytes = 0
+        self.cached = False
+
+    def add(self, phase, duration):
+        """ Adds `duration` seconds to the phase `phase` """
+        self.phases[phase] = self.phases.get(phase, 0.0) + duration
+
+    @contextmanager
+    def span(self, phase):
+        """
+        Context manager measuring the time spent in its block as the phase `phase`.
+        The time spent in the database during the block is not counted
+        in `phase`, but in the database phases.
+        """
+        database_time = sum(self.phases.get(name, 0.0) for name in DATABASE_PHASES)
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            elapsed = time.perf_counter() - start
+            database_elapsed = sum(self.phases.get(name, 0.0) for name in DATABASE_PHASES) - database_time
+            self.add(phase, max(elapsed - database_elapsed, 0.0))
+
+    def to_dict(self):
+        """ Returns the profile as a JSON-serializable dict (durations in milliseconds) """
+        return {
+            "courseid": self.courseid,
+            "chart_type": self.chart_type,
+            "date": self.date.isoformat(),
+            "cached": self.cached,
+            "documents": self.documents,
+            "bytes": self.bytes,
+            "phases": {phase: round(duration * 1000, 3) for (phase, duration) in self.phases.items()},
+            "explains": self.explains
+        }
+
+
+class ProfileHistory(object):
+    """ The last profiles of requests, shared by the pages of the webapp process. """
+
+    def __init__(self, size=50):
+        self._profiles = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def configure(self, size):
+        """ Changes the number of profiles kept """
+        with self._lock:
+            self._profiles = deque(self._profiles, maxlen=size)
+
+    def record(self, profile):
+        """ Adds the profile `profile` """
+        with self._lock:
+            self._profiles.append(profile)
+
+    def get_profiles(self, courseid=None):
+        """ Returns the profiles (of the course `courseid` if given) as dicts, most recent first """
+        with self._lock:
+            profiles = list(self._profiles)
+        return [profile.to_dict() for profile in reversed(profiles)
+                if courseid is None or profile.courseid == courseid]
@@ -0,0 +1,195 @@
+"""
+Plugin for INGInious released under AGPL-3.0
+Created by a team at OpenWeek2019
+Florian Damhaut, Céline Deknop, Simon Gustin and Maxime Mawait
+
+Helpers to build and measure the queries on the submissions.
+"""
+
+import json
+import time
+
+import bson
+from bson import json_util
+
+# Fields of a submission needed by the statistics. The large ones (input,
+# archive, text, stdout, stderr, problems, ...) are never transferred.
+STATS_FIELDS = ("courseid", "taskid", "username", "submitted_on", "grade", "result", "tests")
+
+
+def submissions_match(courseid, daterange, tasks_id=None, grade_bounds=None):
+    """
+    Returns the `$match` filter on the submissions of the course `courseid`
+    made during `daterange`, for the tasks `tasks_id` (all the tasks if None,
+    none if empty) and with grade in `grade_bounds` (any grade if None).
+    The tags filters are resolved to task ids beforehand (see `TaskIndex`).
+    """
+    match = {"submitted_on": {"$gte": daterange[0], "$lt": daterange[1]}, "courseid": courseid}
+    if tasks_id is not None:
+        match["taskid"] = {"$in": list(tasks_id)}
+    if grade_bounds is not None:
+        match["grade"] = {"$gte": grade_bounds[0], "$lte": grade_bounds[1]}
+    return match
+
+
+def graded_match(match):
+    """
+    Returns the filter `match` restricted to the graded submissions: the
+    submissions waiting for the grader have no grade yet. Filters on the
+    grade (see `submissions_match`) already exclude them.
+    """
+    if "grade" in match:
+        return match
+    return dict(match, grade={"$exists": True})
+
+
+def submissions_pipeline(match, fields=STATS_FIELDS):
+    """
+    Returns the first stages of a pipeline on the submissions:
+    the `$match` filter `match`, then a projection on `fields` only.
+    """
+    projection = {"_id": 0}
+    projection.update({field: 1 for field in fields})
+    return [{"$match": match}, {"$project": projection}]
+
+
+def grouped_grades_pipeline(match, group_by, best=False):
+    """
+    Returns the aggregation pipeline counting the grades of the submissions
+    matching `match` per group and histogram bucket (one per percent), with
+    their sum, sum of squares, min and max. The groups are the tasks
+    (`group_by` "task", also used to group by tag with the tags of the tasks)
+    or the students ("student", also used to group by classroom).
+    If `best`, only the best grade of each student for each task is counted.
+    Each result is {"_id": {"key": group, "bin": bucket}, "count", "sum",
+    "sum_squares", "min", "max"}.
+    """
+    pipeline = submissions_pipeline(match) + [{"$unwind": "$username"}]
+    if best:
+        pipeline += [
+            {"$group": {"_id": {"username": "$username", "taskid": "$taskid"}, "grade": {"$max": "$grade"}}},
+            {"$project": {"_id": 0, "username": "$_id.username", "taskid": "$_id.taskid", "grade": 1}}
+        ]
+
+    if group_by in ("task", "tag"):
+        key = "$taskid"
+    else:
+        key = "$username"
+
+    pipeline.append({"$group": {"_id": {"key": key, "bin": {"$floor": "$grade"}},
+                                "count": {"$sum": 1}, "sum": {"$sum": "$grade"},
+                                "sum_squares": {"$sum": {"$multiply": ["$grade", "$grade"]}},
+                                "min": {"$min": "$grade"}, "max": {"$max": "$grade"}}})
+    return pipeline
+
+
+class TransferCounter(object):
+    """
+    Counts the documents received from the database, and their size in
+    bytes if `count_bytes` (which requires encoding them again).
+    """
+
+    def __init__(self, count_bytes=True):
+        self.count_bytes = count_bytes
+        self.documents = 0
+        self.bytes = 0
+
+    def add(self, document):
+        """ Counts the document `document` """
+        self.documents += 1
+        if self.count_bytes:
+            self.bytes += len(bson.BSON.encode(document))
+
+
+class CountingCursor(object):
+    """ Wraps a cursor to count the documents it returns, and time their transfer. """
+
+    def __init__(self, cursor, counter, profile=None):
+        self._cursor = cursor
+        self._counter = counter
+        self._profile = profile
+
+    def sort(self, *args, **kwargs):
+        self._cursor = self._cursor.sort(*args, **kwargs)
+        return self
+
+    def limit(self, *args, **kwargs):
+        self._cursor = self._cursor.limit(*args, **kwargs)
+        return self
+
+    def __iter__(self):
+        iterator = iter(self._cursor)
+        while True:
+            start = time.perf_counter()
+            try:
+                document = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                if self._profile is not None:
+                    self._profile.add("transfer", time.perf_counter() - start)
+            self._counter.add(document)
+            yield document
+
+
+class CountingCollection(object):
+    """
+    Wraps a collection so that the results of `find` and `aggregate` are
+    counted, and their query and transfer times added to `profile`.
+    If `explain`, the plan of each aggregation is added to the profile.
+    """
+
+    def __init__(self, collection, counter, profile=None, explain=False):
+        self._collection = collection
+        self._counter = counter
+        self._profile = profile
+        self._explain = explain
+
+    def _timed(self, function, *args, **kwargs):
+        """ Calls `function`, adding its duration to the "query" phase of the profile """
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            if self._profile is not None:
+                self._profile.add("query", time.perf_counter() - start)
+
+    def find(self, *args, **kwargs):
+        return CountingCursor(self._timed(self._collection.find, *args, **kwargs), self._counter, self._profile)
+
+    def find_one(self, *args, **kwargs):
+        document = self._timed(self._collection.find_one, *args, **kwargs)
+        if document is not None:
+            self._counter.add(document)
+        return document
+
+    def aggregate(self, pipeline, **kwargs):
+        if self._explain and self._profile is not None:
+            plan = self._collection.database.command(
+                "explain", {"aggregate": self._collection.name, "pipeline": pipeline, "cursor": {}},
+                verbosity="queryPlanner")
+            self._profile.explains.append(json.loads(json_util.dumps(plan)))
+        return CountingCursor(self._timed(self._collection.aggregate, pipeline, **kwargs),
+                              self._counter, self._profile)
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+
+class CountingDatabase(object):
+    """
+    Wraps a database so that the documents received from its collections
+    are counted in `counter`, and the time spent querying them in `profile`.
+    """
+
+    def __init__(self, database, counter, profile=None, explain=False):
+        self._database = database
+        self.counter = counter
+        self.profile = profile
+        self.explain = explain
+
+    def __getitem__(self, name):
+        return CountingCollection(self._database[name], self.counter, self.profile, self.explain)
+
+    def __getattr__(self, name):
+        return CountingCollection(getattr(self._database, name), self.counter, self.profile, self.explain)
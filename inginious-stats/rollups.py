@@ -0,0 +1,431 @@
+"""
+Plugin for INGInious released under AGPL-3.0
+Created by a team at OpenWeek2019
+Florian Damhaut, Céline Deknop, Simon Gustin and Maxime Mawait
+
+Materialized per-course, per-task, per-day statistics ("rollups").
+
+Submissions of a day never change once the day is over, so each closed day
+is aggregated once into the `adv_stats_rollups` collection (counts, grade
+histogram, successes, number of attempts before the first success).
+The progress of each student on each task (attempts so far, first success)
+is kept in `adv_stats_progress` so that first-success attempt counts can be
+maintained without reading the whole history again.
+`adv_stats_rollups_meta` records, for each course, the date until which
+the submissions have been rolled up.
+
+The rollups are advanced when a submission is completed (see `on_submission_done`),
+and can be (re)built for existing data with:
+
+    python3 -m inginious-stats.rollups --host mongodb://localhost --database INGInious [courseid ...]
+"""
+
+import argparse
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from .queries import graded_match, submissions_match, submissions_pipeline
+
+ROLLUPS = "adv_stats_rollups"
+PROGRESS = "adv_stats_progress"
+META = "adv_stats_rollups_meta"
+
+# Number of buckets of the grade histograms, one per integer percentage from 0% to 100%
+GRADE_BINS = 101
+
+# A day is only rolled up this long after its end, to let the grading of
+# the submissions made at the end of the day complete
+GRACE_PERIOD = timedelta(hours=1)
+
+# Time after which a roll up that did not complete is considered to have crashed
+LOCK_TIMEOUT = timedelta(minutes=30)
+
+_logger = logging.getLogger("inginious.webapp.plugins.adv_stats")
+
+
+def day_start(moment):
+    """ Returns the beginning of the day of the datetime `moment`. """
+    return datetime(moment.year, moment.month, moment.day)
+
+
+def ensure_indexes(database):
+    """ Creates the indexes of the rollup collections. """
+    database[ROLLUPS].create_index([("courseid", 1), ("taskid", 1), ("day", 1)], unique=True)
+    database[ROLLUPS].create_index([("courseid", 1), ("day", 1)])
+    database[PROGRESS].create_index([("courseid", 1), ("taskid", 1), ("username", 1)], unique=True)
+    database[META].create_index("courseid", unique=True)
+
+
+def get_rolled_up_until(database, courseid):
+    """
+    Returns the datetime before which all the submissions of the course
+    `courseid` are rolled up, or None if the course was never rolled up.
+    """
+    meta = database[META].find_one({"courseid": courseid}, {"until": 1})
+    if meta is None:
+        return None
+    return meta.get("until")
+
+
+def split_daterange(daterange, until):
+    """
+    Splits `daterange` in the part that can be read from the rollups
+    (whole days before `until`) and the parts that must be read from the
+    raw submissions.
+    :return: a tuple (range of days to read from the rollups or None, list of raw ranges)
+    """
+    (start, end) = daterange
+    if until is None:
+        return None, [daterange]
+
+    first_day = day_start(start)
+    if first_day < start:
+        first_day += timedelta(days=1)
+    last_day = min(day_start(end), until)
+    if first_day >= last_day:
+        return None, [daterange]
+
+    raw_ranges = []
+    if start < first_day:
+        raw_ranges.append((start, first_day))
+    if last_day < end:
+        raw_ranges.append((last_day, end))
+    return (first_day, last_day), raw_ranges
+
+
+def grade_histogram_pipeline(match, by_day=False):
+    """
+    Returns the aggregation pipeline computing, for each task (and each day
+    if `by_day`) of the graded submissions matching `match`: the number of submissions
+    per student ("submissions") and of submission documents ("documents"),
+    the number of successes, the sum, sum of squares, min, max and histogram
+    of the grades, and the tags of the first submission.
+    """
+    key = {"taskid": "$taskid"}
+    if by_day:
+        key["day"] = {"$dateToString": {"format": "%Y-%m-%d", "date": "$submitted_on"}}
+    grade_bin = {"$min": [GRADE_BINS - 1, {"$max": [0, {"$floor": "$grade"}]}]}
+    group_by_bin = dict(key, bin=grade_bin)
+    first_key = {name: "$_id." + name for name in key}
+
+    return submissions_pipeline(graded_match(match)) + [
+        {"$unwind": {"path": "$username", "includeArrayIndex": "userIndex"}},
+        {"$group": {"_id": group_by_bin,
+                    "count": {"$sum": 1},
+                    "documents": {"$sum": {"$cond": [{"$eq": ["$userIndex", 0]}, 1, 0]}},
+                    "sumGrade": {"$sum": "$grade"},
+                    "sumSquares": {"$sum": {"$multiply": ["$grade", "$grade"]}},
+                    "minGrade": {"$min": "$grade"}, "maxGrade": {"$max": "$grade"},
+                    "validSubmissions":
+                        {"$sum": {"$cond": {"if": {"$eq": ["$result", "success"]}, "then": 1, "else": 0}}},
+                    "username": {"$first": "$username"}, "tags": {"$first": "$tests"}}},
+        {"$group": {"_id": first_key,
+                    "submissions": {"$sum": "$count"}, "documents": {"$sum": "$documents"},
+                    "sumGrade": {"$sum": "$sumGrade"}, "sumSquares": {"$sum": "$sumSquares"},
+                    "minGrade": {"$min": "$minGrade"}, "maxGrade": {"$max": "$maxGrade"},
+                    "validSubmissions": {"$sum": "$validSubmissions"},
+                    "histogram": {"$push": {"bin": "$_id.bin", "count": "$count"}},
+                    "username": {"$first": "$username"}, "tags": {"$first": "$tags"}}}
+    ]
+
+
+def _dense_histogram(buckets):
+    """ Converts the list of {bin, count} returned by the pipeline to a list of `GRADE_BINS` counts. """
+    histogram = [0]*GRADE_BINS
+    for bucket in buckets:
+        histogram[int(bucket["bin"])] += bucket["count"]
+    return histogram
+
+
+def merge_task_rows(rows_per_task, row):
+    """
+    Merges the statistics `row` (a rollup document, or a row returned by
+    `grade_histogram_pipeline` with a dense histogram) into the dict
+    `rows_per_task` mapping task ids to their statistics.
+    """
+    taskid = row["taskid"]
+    if taskid not in rows_per_task:
+        rows_per_task[taskid] = {"_id": taskid, "submissions": 0, "documents": 0, "validSubmissions": 0,
+                                 "sumGrade": 0, "sumSquares": 0, "minGrade": None, "maxGrade": None,
+                                 "histogram": [0]*GRADE_BINS, "username": row.get("username"),
+                                 "tags": row.get("tags") or {}}
+    merged = rows_per_task[taskid]
+    for field in ("submissions", "documents", "validSubmissions", "sumGrade", "sumSquares"):
+        merged[field] += row[field]
+    if row["minGrade"] is not None and (merged["minGrade"] is None or row["minGrade"] < merged["minGrade"]):
+        merged["minGrade"] = row["minGrade"]
+    if row["maxGrade"] is not None and (merged["maxGrade"] is None or row["maxGrade"] > merged["maxGrade"]):
+        merged["maxGrade"] = row["maxGrade"]
+    merged["histogram"] = [a + b for (a, b) in zip(merged["histogram"], row["histogram"])]
+    return rows_per_task
+
+
+def raw_task_rows(database, courseid, daterange, grade_bounds=None):
+    """
+    Runs `grade_histogram_pipeline` on the raw submissions of `courseid` in `daterange`
+    and returns the rows per task, with dense histograms and the task id in "_id" and "taskid".
+    """
+    match = submissions_match(courseid, daterange, grade_bounds=grade_bounds)
+    rows = []
+    for row in database.submissions.aggregate(grade_histogram_pipeline(match), allowDiskUse=True):
+        row["taskid"] = row["_id"] = row["_id"]["taskid"]
+        row["histogram"] = _dense_histogram(row["histogram"])
+        rows.append(row)
+    return rows
+
+
+def task_rows(database, courseid, daterange):
+    """
+    Returns the statistics per task of the submissions of `courseid` in
+    `daterange`, reading the rolled-up days from the rollups and only the
+    remaining parts of the range from the raw submissions.
+    The rows have the fields of `grade_histogram_pipeline`, with dense histograms.
+    """
+    (rolled_days, raw_ranges) = split_daterange(daterange, get_rolled_up_until(database, courseid))
+    rows_per_task = {}
+    if rolled_days is not None:
+        for row in database[ROLLUPS].find({"courseid": courseid,
+                                           "day": {"$gte": rolled_days[0], "$lt": rolled_days[1]}}):
+            merge_task_rows(rows_per_task, row)
+    for raw_range in raw_ranges:
+        for row in raw_task_rows(database, courseid, raw_range):
+            merge_task_rows(rows_per_task, row)
+    return list(rows_per_task.values())
+
+
+def submissions_per_day(database, courseid, tasks_id, daterange):
+    """
+    Returns a dict mapping each day (ISO format) to the number of rolled-up
+    submissions of the tasks `tasks_id` (all the tasks if None) made on this
+    day, for the whole days of `daterange` that are rolled up, and the list of
+    ranges of `daterange` that must still be read from the raw submissions.
+    """
+    (rolled_days, raw_ranges) = split_daterange(daterange, get_rolled_up_until(database, courseid))
+    result = {}
+    if rolled_days is not None:
+        match = {"courseid": courseid, "day": {"$gte": rolled_days[0], "$lt": rolled_days[1]}}
+        if tasks_id is not None:
+            match["taskid"] = {"$in": list(tasks_id)}
+        for row in database[ROLLUPS].aggregate([{"$match": match},
+                                                {"$group": {"_id": "$day", "documents": {"$sum": "$documents"}}}]):
+            result[row["_id"].date().isoformat()] = row["documents"]
+    return result, raw_ranges
+
+
+def attempts_pipeline(match, grade_bounds=None):
+    """
+    Returns the aggregation pipeline computing, for each student and task
+    of the submissions matching `match`, the date of the first success
+    ("firstSuccess", None if there is none) and the number of attempts
+    before it ("attempts"), counting only attempts with grade in `grade_bounds`.
+    """
+    if grade_bounds is None:
+        attempt = "$submitted_on"
+    else:
+        attempt = {"$cond": [{"$and": [{"$gte": ["$grade", grade_bounds[0]]}, {"$lte": ["$grade", grade_bounds[1]]}]},
+                             "$submitted_on", None]}
+    return [
+        {"$match": match},
+        {"$project": {"_id": 0, "taskid": 1, "submitted_on": 1, "grade": 1,
+                      "username": {"$arrayElemAt": ["$username", 0]},
+                      "success": {"$eq": ["$result", "success"]}}},
+        {"$group": {"_id": {"taskid": "$taskid", "username": "$username"},
+                    "firstSuccess": {"$min": {"$cond": ["$success", "$submitted_on", None]}},
+                    "times": {"$push": attempt}}},
+        {"$project": {"firstSuccess": 1, "attempts": {"$size": {"$filter": {
+            "input": "$times", "as": "time",
+            "cond": {"$and": [{"$ne": ["$$time", None]},
+                              {"$or": [{"$eq": ["$firstSuccess", None]},
+                                       {"$lt": ["$$time", "$firstSuccess"]}]}]}}}}}}
+    ]
+
+
+def attempts_progress(database, courseid, tasks_id, daterange):
+    """
+    Returns the distribution of the number of attempts before the first
+    success of the students on the tasks (a dict mapping a number of
+    attempts to the number of student and task pairs), using the
+    progress maintained with the rollups and the raw submissions made after
+    the last rolled-up day.
+    Only valid for the whole history of the course (`daterange` starting at
+    `datetime.min`) and without grade bounds: returns None when the rollups
+    cannot answer the query.
+    """
+    until = get_rolled_up_until(database, courseid)
+    if until is None or daterange[0] != datetime.min or daterange[1] < until:
+        return None
+
+    match = {"courseid": courseid}
+    if tasks_id is not None:
+        match["taskid"] = {"$in": list(tasks_id)}
+
+    result = {}
+    for progress in database[PROGRESS].find(match, {"username": 1, "taskid": 1, "attempts": 1, "done": 1}):
+        result.setdefault(progress["username"], {})[progress["taskid"]] = {"attempts": progress["attempts"],
+                                                                           "done": progress["done"]}
+
+    match = graded_match(dict(match, submitted_on={"$gte": until, "$lt": daterange[1]}))
+    tail = database.submissions.find(match, {"username": 1, "taskid": 1, "result": 1}).sort("submitted_on", 1)
+    for x in tail:
+        state = result.setdefault(x["username"][0], {}).setdefault(x["taskid"], {"attempts": 0, "done": False})
+        if x["result"] == "success":
+            state["done"] = True
+        if not state["done"]:
+            state["attempts"] += 1
+
+    distribution = {}
+    for states in result.values():
+        for state in states.values():
+            distribution[state["attempts"]] = distribution.get(state["attempts"], 0) + 1
+    return distribution
+
+
+def _claim(database, courseid, now):
+    """ Takes the roll-up lock of the course, returns its meta document or None if already taken. """
+    database[META].update_one({"courseid": courseid}, {"$setOnInsert": {"until": None}}, upsert=True)
+    return database[META].find_one_and_update(
+        {"courseid": courseid, "$or": [{"lock": {"$exists": False}}, {"lock": {"$lt": now}}]},
+        {"$set": {"lock": now + LOCK_TIMEOUT}})
+
+
+def _first_day(database, courseid, target):
+    """ Returns the day of the first submission of the course (or `target` if there are none). """
+    for first in database.submissions.find({"courseid": courseid}, {"submitted_on": 1}).sort("submitted_on", 1).limit(1):
+        return min(day_start(first["submitted_on"]), target)
+    return target
+
+
+def _roll_up_attempts(database, courseid, window):
+    """
+    Updates the progress of the students with the graded submissions in `window`
+    and returns a dict mapping (taskid, day) to the number of students
+    whose first success was on this day, per number of attempts.
+    Each progress document records the window it was last updated with and
+    its attempts before that window, so that rolling up the same window again
+    (after a failure, or by another process once the lock expired) recomputes
+    the same progress instead of counting the attempts twice.
+    """
+    progress = {(x["taskid"], x["username"]): x
+                for x in database[PROGRESS].find({"courseid": courseid},
+                                                 {"taskid": 1, "username": 1, "attempts": 1, "done": 1,
+                                                  "window_start": 1, "previous_attempts": 1})}
+
+    match = graded_match({"courseid": courseid, "submitted_on": {"$gte": window[0], "$lt": window[1]}})
+    rows = database.submissions.aggregate(attempts_pipeline(match), allowDiskUse=True)
+
+    first_successes = {}
+    for row in rows:
+        key = (row["_id"]["taskid"], row["_id"]["username"])
+        state = progress.get(key)
+        if state is None:
+            previous = 0
+        elif state.get("window_start") == window[0]:  # this window was already (partly) applied
+            previous = state.get("previous_attempts", 0)
+        elif state["done"]:
+            continue
+        else:
+            previous = state["attempts"]
+        attempts = previous + row["attempts"]
+        update = {"attempts": attempts, "done": row["firstSuccess"] is not None,
+                  "success_on": row["firstSuccess"], "window_start": window[0], "previous_attempts": previous}
+        database[PROGRESS].update_one({"courseid": courseid, "taskid": key[0], "username": key[1]},
+                                      {"$set": update}, upsert=True)
+        if row["firstSuccess"] is not None:
+            day_counts = first_successes.setdefault((key[0], day_start(row["firstSuccess"])), {})
+            day_counts[str(attempts)] = day_counts.get(str(attempts), 0) + 1
+    return first_successes
+
+
+def roll_up_course(database, courseid, now=None, create=True):
+    """
+    Rolls up all the days of the course `courseid` that ended (for more
+    than `GRACE_PERIOD`) since the last roll up.
+    If `create` is False, courses that were never rolled up are left untouched.
+    :return: the datetime until which the course is rolled up
+    """
+    now = now or datetime.now()
+    target = day_start(now - GRACE_PERIOD)
+    until = get_rolled_up_until(database, courseid)
+    if (until is None and not create) or (until is not None and until >= target):
+        return until
+
+    meta = _claim(database, courseid, now)
+    if meta is None:  # Another process is rolling up this course
+        return until
+    try:
+        until = meta.get("until") or _first_day(database, courseid, target)
+        if until < target:
+            window = (until, target)
+            first_successes = _roll_up_attempts(database, courseid, window)
+            match = {"courseid": courseid, "submitted_on": {"$gte": window[0], "$lt": window[1]}}
+            for row in database.submissions.aggregate(grade_histogram_pipeline(match, by_day=True),
+                                                      allowDiskUse=True):
+                taskid = row["_id"]["taskid"]
+                day = datetime.strptime(row["_id"]["day"], "%Y-%m-%d")
+                rollup = {"submissions": row["submissions"], "documents": row["documents"],
+                          "validSubmissions": row["validSubmissions"],
+                          "sumGrade": row["sumGrade"], "sumSquares": row["sumSquares"],
+                          "minGrade": row["minGrade"], "maxGrade": row["maxGrade"],
+                          "histogram": _dense_histogram(row["histogram"]),
+                          "tags": row["tags"] or {}, "username": row["username"],
+                          "firstSuccessAttempts": first_successes.get((taskid, day), {})}
+                database[ROLLUPS].update_one({"courseid": courseid, "taskid": taskid, "day": day},
+                                             {"$set": rollup}, upsert=True)
+            until = target
+        database[META].update_one({"courseid": courseid}, {"$set": {"until": until}, "$unset": {"lock": ""}})
+    except Exception:
+        database[META].update_one({"courseid": courseid}, {"$unset": {"lock": ""}})
+        raise
+    return until
+
+
+def on_submission_done(database, submission):
+    """
+    Hook called when a submission is completed: rolls up the days of its
+    course that ended since the last roll up, in a background thread.
+    Courses that were never backfilled are ignored.
+    """
+    courseid = submission["courseid"]
+    until = get_rolled_up_until(database, courseid)
+    if until is None or until >= day_start(datetime.now() - GRACE_PERIOD):
+        return
+
+    def roll_up():
+        try:
+            roll_up_course(database, courseid, create=False)
+        except Exception:  # pylint: disable=broad-except
+            _logger.exception("Could not roll up the statistics of course %s", courseid)
+
+    threading.Thread(target=roll_up, daemon=True).start()
+
+
+def reset_course(database, courseid):
+    """ Removes all the rollups of the course `courseid`. """
+    database[ROLLUPS].delete_many({"courseid": courseid})
+    database[PROGRESS].delete_many({"courseid": courseid})
+    database[META].delete_many({"courseid": courseid})
+
+
+def main():
+    """ Backfills the rollups of existing courses. """
+    import pymongo
+
+    parser = argparse.ArgumentParser(description="Backfills the statistics rollups of the advanced statistics plugin.")
+    parser.add_argument("--host", default="localhost", help="MongoDB host (or URI)")
+    parser.add_argument("--database", default="INGInious", help="Name of the INGInious database")
+    parser.add_argument("--reset", action="store_true", help="Rebuild the rollups from scratch")
+    parser.add_argument("courseid", nargs="*", help="Courses to backfill (all by default)")
+    args = parser.parse_args()
+
+    database = pymongo.MongoClient(args.host)[args.database]
+    ensure_indexes(database)
+    for courseid in args.courseid or database.submissions.distinct("courseid"):
+        if args.reset:
+            reset_course(database, courseid)
+        until = roll_up_course(database, courseid)
+        print("{}: rolled up until {}".format(courseid, until))
+
+
+if __name__ == "__main__":
+    main()
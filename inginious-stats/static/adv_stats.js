@@ -42,6 +42,97 @@ function fillFilters(query) {
     if (query.filter_exercises) {
         $("#filter_exercises")[0].value = query.filter_exercises;
     }
+    if (query.time_granularity) {
+        $("#time_granularity")[0].value = query.time_granularity;
+    }
+    if (query.timezone) {
+        $("#timezone")[0].value = query.timezone;
+    }
+    if (query.group_by) {
+        $("#group_by")[0].value = query.group_by;
+    }
+}
+
+//=========== Loading ================
+function initStatsForm(apiUrl) {
+    /* Makes the form load the requested chart without reloading the page. */
+    $("#stats_form").on("submit", function(event) {
+        // Export buttons submit the form to another page
+        const submitter = event.originalEvent ? event.originalEvent.submitter : undefined;
+        if (submitter && submitter.hasAttribute("formaction"))
+            return;
+        event.preventDefault();
+        let query = {};
+        for (let field of $(this).serializeArray())
+            query[field.name] = field.value;
+        loadChart(apiUrl, query, "canvas");
+    });
+}
+
+function loadChart(apiUrl, query, canvasId) {
+    /*
+     * Fetches the statistics of the chart described by `query` from the JSON API,
+     * and displays them in the canvas `canvasId` (and the statistics table).
+     * Returns a promise, so that several charts can be loaded in parallel.
+     */
+    let body = new URLSearchParams(query);
+    body.set("binned", "1");
+    $("#results").show();
+    return fetch(apiUrl, {method: "POST", body: body, credentials: "same-origin"})
+        .then(response => response.json())
+        .then(function(result) {
+            // Slow charts are computed in the background: wait for the result
+            if (result.job === undefined)
+                return result;
+            $("#profile").text("Computing the chart...");
+            return _waitForJob(apiUrl + "/jobs/" + result.job);
+        })
+        .then(function(result) {
+            const stats = result.statistics;
+            const chartQuery = result.query;
+            if (stats === null) {
+                makeChart(chartQuery, undefined, undefined, undefined, canvasId);
+                addStatsTable(undefined);
+            } else if (stats.groups !== undefined) {
+                _displayBoxPlot(stats.groups, canvasId);
+                addStatsTable(stats);
+            } else if (stats.bars !== undefined) {
+                _displayBars(chartQuery, stats.labels, stats.bars, canvasId);
+                addStatsTable(stats);
+            } else {
+                makeChart(chartQuery, stats.raw_data, stats.times, stats.histogram, canvasId);
+                addStatsTable(stats);
+            }
+            addProfile(result.profile);
+        })
+        .catch(function() {
+            _showEmptyChart(canvasId);
+        });
+}
+
+function _waitForJob(jobUrl, delay=500) {
+    /* Polls the status of a background job until it is done, returns a promise of its result. */
+    return fetch(jobUrl, {credentials: "same-origin"})
+        .then(response => response.json())
+        .then(function(job) {
+            if (job.status == "done")
+                return job.result;
+            if (job.status == "failed")
+                throw new Error(job.error);
+            return new Promise(resolve => setTimeout(resolve, delay))
+                .then(() => _waitForJob(jobUrl, Math.min(2 * delay, 5000)));
+        });
+}
+
+function addProfile(profile) {
+    /* Shows the time spent in each phase of the computation of the chart. */
+    let phases = [];
+    for (let phase of Object.keys(profile.phases).sort())
+        phases.push(phase + ": " + profile.phases[phase].toFixed(1) + " ms");
+    let text = phases.join("; ") + "; " + profile.documents + " documents received";
+    if (profile.cached)
+        text += " (from cache)";
+    $("#profile").text(text);
 }
 
 //=========== Table ==================
@@ -55,7 +146,11 @@ function addStatsTable(stats) {
             median: "N/A",
             mode: "N/A",
             variance: "N/A",
-            std_deviation: "N/A"
+            std_deviation: "N/A",
+            p10: "N/A",
+            p25: "N/A",
+            p75: "N/A",
+            p90: "N/A"
         };
     }
     /* Creates and puts a table of statistics requested by the user on the page. */
@@ -67,6 +162,8 @@ function addStatsTable(stats) {
     $("#table-mode")[0].innerHTML = stats.mode;
     $("#table-variance")[0].innerHTML = stats.variance;
     $("#table-std-deviation")[0].innerHTML = stats.std_deviation;
+    for (let percentile of [10, 25, 75, 90])
+        $("#table-p" + percentile)[0].innerHTML = stats["p" + percentile];
 }
 
 //============== Charts ====================
@@ -78,10 +175,10 @@ const chartTypeCorrespondence = {
     "tag-sorted": makeTagSortedChart
 }
 
-function makeChart(chartQuery, dataPoints, times) {
+function makeChart(chartQuery, dataPoints, times, histogram, canvasId="canvas") {
     /* Creates the chart requested by the user and adds it to the page. */
     if (dataPoints === undefined) {
-        _showEmptyChart();
+        _showEmptyChart(canvasId);
         return;
     }
 
@@ -95,15 +192,18 @@ function makeChart(chartQuery, dataPoints, times) {
         data[i] = tmp;
     }
 
-    if ((chartTypeStr == "grades-distribution" || chartTypeStr == "submission-before-perfect") && dataPoints)
-        chartTypeCorrespondence[chartTypeStr](chartQuery, dataPoints);
+    if (chartTypeStr == "grades-distribution" && histogram && histogram.length > 0)
+        makeGradeDistroChartFromHistogram(chartQuery, histogram, canvasId);
+    else if ((chartTypeStr == "grades-distribution" || chartTypeStr == "submission-before-perfect" ||
+              chartTypeStr == "lines-per-submission") && dataPoints)
+        chartTypeCorrespondence[chartTypeStr](chartQuery, dataPoints, canvasId);
     else if (chartTypeStr == "submissions-time" && dataPoints)
-        chartTypeCorrespondence[chartTypeStr](chartQuery, dataPoints, times);
+        chartTypeCorrespondence[chartTypeStr](chartQuery, dataPoints, times, canvasId);
     else
-        chartTypeCorrespondence[chartTypeStr](chartQuery, data);
+        chartTypeCorrespondence[chartTypeStr](chartQuery, data, canvasId);
 }
 
-function makeGradeDistroChart(query, rawData) {
+function makeGradeDistroChart(query, rawData, canvasId="canvas") {
     // TODO This doesn't work for non integer numbers in `rawData`
     const nbBars = 20;
     const bars = _computeBarSizes(
@@ -111,12 +211,23 @@ function makeGradeDistroChart(query, rawData) {
     if (bars) {
         const data = bars["bars"];
         const labels = bars["labels"];
-        _displayChart("bar", labels, data, "Grade", "Number of submissions");
+        _displayChart("bar", labels, data, "Grade", "Number of submissions", canvasId);
+    } else {
+        _showEmptyChart(canvasId);
+    }
+}
+function makeGradeDistroChartFromHistogram(query, histogram, canvasId="canvas") {
+    /* Same as makeGradeDistroChart, from the histogram (one bucket per percent) computed by the server. */
+    const nbBars = 20;
+    const bars = _groupHistogram(
+        histogram, nbBars, parseFloat(query.min_submission_grade), parseFloat(query.max_submission_grade));
+    if (bars) {
+        _displayChart("bar", bars["labels"], bars["bars"], "Grade", "Number of submissions", canvasId);
     } else {
-        _showEmptyChart();
+        _showEmptyChart(canvasId);
     }
 }
-function makeNbSubmissionsBfPerfectChart(query, rawData) {
+function makeNbSubmissionsBfPerfectChart(query, rawData, canvasId="canvas") {
     const min = 0;
     const nbBars = 100;
     const bars = _computeBarSizes(
@@ -125,25 +236,92 @@ function makeNbSubmissionsBfPerfectChart(query, rawData) {
     if (bars) {
         const data = bars["bars"];
         const labels = bars["labels"];
-        _displayChart("bar", labels, data, "Number of submissions", "Number of students");
+        _displayChart("bar", labels, data, "Number of submissions", "Number of students", canvasId);
+    } else {
+        _showEmptyChart(canvasId);
+    }
+}
+function makeLinePerSubmissionChart(query, rawData, canvasId="canvas") {
+    const nbBars = 20;
+    const bars = _computeBarSizes("discrete", rawData, nbBars);
+    if (bars) {
+        _displayChart("bar", bars["labels"], bars["bars"], "Number of lines", "Number of submissions", canvasId);
     } else {
-        _showEmptyChart();
+        _showEmptyChart(canvasId);
     }
 }
-function makeLinePerSubmissionChart(query, data) {
-    const min = 5; // TODO find min from data
-    const max = 201; // TODO find max from data // TODO max is not included
-    const processedData = _groupBars(data);
-    const labels = _createConsecutiveLabels(min, max);
-    _displayChart("bar", labels, data);
+function makeSubmissionTimeGraph(query, data, times, canvasId="canvas") {
+    _displayChart("line", times, data, "Date", "Number of submissions", canvasId);
 }
-function makeSubmissionTimeGraph(query, data, times) {
-    _displayChart("line", times, data, "Date", "Number of submissions");
+function makeTagSortedChart(query, data, canvasId="canvas") {
+    _displayChart("bar", ["Timeout", "Segfault", "Cannot compile", "Could compile"], data, "Grade", "Number of submissions", canvasId);
 }
-function makeTagSortedChart(query, data) {
-    _displayChart("bar", ["Timeout", "Segfault", "Cannot compile", "Could compile"], data);
+
+const barsAxes = {
+    "grades-distribution": ["bar", "Grade", "Number of submissions"],
+    "submission-before-perfect": ["bar", "Number of submissions", "Number of students"],
+    "lines-per-submission": ["bar", "Number of lines", "Number of submissions"],
+    "submissions-time": ["line", "Date", "Number of submissions"],
+    "tag-sorted": ["bar", "Tag", "Number of submissions"]
+};
+function _displayBars(query, labels, bars, canvasId="canvas") {
+    /* Displays the bars computed by the server for the chart described by `query`. */
+    const axes = barsAxes[query.chart_type] || ["bar", "Grade", "Number of submissions"];
+    if (bars.length == 0)
+        _showEmptyChart(canvasId);
+    else
+        _displayChart(axes[0], labels, bars, axes[1], axes[2], canvasId);
 }
 
+function _displayBoxPlot(groups, canvasId="canvas") {
+    /*
+     * Displays one box per group of `groups` (labels, names of the columns and matrix of
+     * statistics per group), as stacked bars: whiskers from the 10th to the 90th percentile,
+     * box from the 25th to the 75th percentile, split at the median.
+     */
+    const column = name => groups.columns.indexOf(name);
+    const values = name => groups.matrix.map(row => row[column(name)]);
+    const [p10, p25, median, p75, p90] = ["p10", "p25", "median", "p75", "p90"].map(values);
+    const difference = (top, bottom) => top.map((value, i) => value - bottom[i]);
+    const segments = [
+        ["", p10, "rgba(0, 0, 0, 0)"],
+        ["10th to 25th percentile", difference(p25, p10), "rgba(255, 99, 132, 0.1)"],
+        ["25th percentile to median", difference(median, p25), "rgba(255, 99, 132, 0.4)"],
+        ["Median to 75th percentile", difference(p75, median), "rgba(255, 99, 132, 0.4)"],
+        ["75th to 90th percentile", difference(p90, p75), "rgba(255, 99, 132, 0.1)"]
+    ];
+
+    if (displayedCharts[canvasId] !== undefined)
+        displayedCharts[canvasId].destroy();
+    const ctx = document.getElementById(canvasId).getContext('2d');
+    displayedCharts[canvasId] = new Chart(ctx, {
+        type: "bar",
+        data: {
+            labels: groups.labels,
+            datasets: segments.map(([label, data, color]) => ({
+                label: label,
+                data: data,
+                backgroundColor: color,
+                borderColor: label === "" ? color : 'rgba(255, 99, 132, 1)',
+                borderWidth: label === "" ? 0 : 1
+            }))
+        },
+        options: {
+            legend: {labels: {filter: item => item.text !== ""}},
+            tooltips: {
+                mode: "index",
+                callbacks: {
+                    label: (item) => ["p10", "p25", "median", "p75", "p90"][item.datasetIndex] + ": " +
+                        groups.matrix[item.index][column(["p10", "p25", "median", "p75", "p90"][item.datasetIndex])]
+                }
+            },
+            scales: {
+                xAxes: [{stacked: true, scaleLabel: {display: true, labelString: "Group (" + groups.by + ")"}}],
+                yAxes: [{stacked: true, ticks: {beginAtZero: true}, scaleLabel: {display: true, labelString: "Grade"}}]
+            }
+        }
+    });
+}
 
 function _computeBarSizes(discreteOrReal, rawData, nbBuckets, min=undefined, max=undefined) {
     if (min === undefined)
@@ -190,6 +368,30 @@ function _computeBarSizes(discreteOrReal, rawData, nbBuckets, min=undefined, max
     return {"bars": result, "labels": labels};
 }
 
+function _groupHistogram(histogram, nbBuckets, min, max) {
+    /*
+     * Groups the buckets of `histogram` (bucket `i` contains the number of grades in [i, i+1[)
+     * between `min` and `max` in `nbBuckets` bars.
+     */
+    min = Math.max(0, Math.floor(min));
+    max = Math.min(histogram.length - 1, Math.floor(max));
+    if (max < min)
+        return null;
+    const valuesPerBucket = Math.max(1, Math.ceil((max - min + 1) / nbBuckets));
+    nbBuckets = Math.ceil((max - min + 1) / valuesPerBucket);
+
+    let result = new Array(nbBuckets).fill(0);
+    let labels = [];
+    for (let i = 0; i < nbBuckets; i++) {
+        const startBucket = min + i*valuesPerBucket;
+        const endBucket = Math.min(max, startBucket + valuesPerBucket - 1);
+        for (let bucket = startBucket; bucket <= endBucket; bucket++)
+            result[i] += histogram[bucket];
+        labels.push(startBucket == endBucket ? startBucket : startBucket + " to " + endBucket);
+    }
+    return {"bars": result, "labels": labels};
+}
+
 const maxNbBars = 200; // TODO tmp, change that number
 function _groupBars(dataGroups) {
     /*
@@ -256,8 +458,11 @@ function _createConsecutiveLabels(min, max, maxNbGroups=maxNbBars) {
     return labels;
 }
 
-function _displayChart(type, labels, data, xLabel="Grade", yLabel="Number of submissions") {
-    var ctx = document.getElementById('canvas').getContext('2d');
+let displayedCharts = {};
+function _displayChart(type, labels, data, xLabel="Grade", yLabel="Number of submissions", canvasId="canvas") {
+    if (displayedCharts[canvasId] !== undefined)
+        displayedCharts[canvasId].destroy();
+    var ctx = document.getElementById(canvasId).getContext('2d');
     var myChart = new Chart(ctx, {
         type: type,
         data: {
@@ -306,11 +511,17 @@ function _displayChart(type, labels, data, xLabel="Grade", yLabel="Number of sub
             }
         }
     });
+    displayedCharts[canvasId] = myChart;
 }
 
-function _showEmptyChart() {
-    let canvas = document.getElementById("canvas");
+function _showEmptyChart(canvasId="canvas") {
+    if (displayedCharts[canvasId] !== undefined) {
+        displayedCharts[canvasId].destroy();
+        delete displayedCharts[canvasId];
+    }
+    let canvas = document.getElementById(canvasId);
     let ctx = canvas.getContext("2d");
+    ctx.clearRect(0, 0, canvas.width, canvas.height);
     ctx.font = "16px Arial";
     ctx.fillStyle = "red";
     ctx.fillText("Nothing to display. lol", 10, 50);
@@ -0,0 +1,130 @@
+"""
+Plugin for INGInious released under AGPL-3.0
+Created by a team at OpenWeek2019
+Florian Damhaut, Céline Deknop, Simon Gustin and Maxime Mawait
+
+Cached index of the tasks of each course, to resolve the filters of the
+charts and name the tasks without parsing the task descriptors on each request.
+"""
+
+import bisect
+import threading
+import time
+
+# Names of the task descriptors, whose modification invalidates the index
+TASK_DESCRIPTORS = ("task.yaml",)
+
+# Minimum time between two checks of the task descriptors of a course, in seconds
+CHECK_INTERVAL = 10
+
+
+class TaskIndex(object):
+    """
+    Index of the tasks of a course: id -> task, name -> ids and tag -> ids.
+    The localized names of the tasks are computed once per language.
+    Only the skill and category tags describe a task: its misconception tags
+    are the ones its grader may set on a submission, so they are not indexed.
+    """
+
+    def __init__(self, tasks):
+        self._tasks = dict(tasks)
+        self._names = {}  # language -> {taskid: localized name}
+        self._ids_by_name = {}
+        self._tags = {}
+        self._ids_by_tag = {}
+        for (taskid, task) in self._tasks.items():
+            self._ids_by_name.setdefault(task._name.strip(), []).append(taskid)  # pylint: disable=protected-access
+            (skills, __, categories) = task.get_tags()
+            self._tags[taskid] = [tag.get_id() for tag in skills + categories]
+            for tag in self._tags[taskid]:
+                self._ids_by_tag.setdefault(tag, []).append(taskid)
+        self._sorted_names = sorted(self._ids_by_name)
+
+    def __contains__(self, taskid):
+        return taskid in self._tasks
+
+    def __iter__(self):
+        return iter(self._tasks)
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def get_name(self, taskid, language):
+        """ Returns the name of the task `taskid` in `language` (its id if there is no such task) """
+        names = self._names.get(language)
+        if names is None:
+            names = {taskid: task.get_name(language) for (taskid, task) in self._tasks.items()}
+            self._names[language] = names
+        return names.get(taskid, taskid)
+
+    def get_tags(self, taskid):
+        """ Returns the ids of the skill and category tags of the task `taskid`, as defined by its descriptor """
+        return self._tags.get(taskid, [])
+
+    def ids_from_names(self, names):
+        """
+        Returns the ids of the tasks named `names`. A name ending with "*" is a
+        prefix: all the tasks whose name starts with it are returned.
+        """
+        ids = []
+        for name in names:
+            if name.endswith("*"):
+                ids.extend(self.ids_with_prefix(name[:-1]))
+            else:
+                ids.extend(self._ids_by_name.get(name, []))
+        return ids
+
+    def ids_with_prefix(self, prefix):
+        """ Returns the ids of the tasks whose name starts with `prefix` """
+        ids = []
+        for index in range(bisect.bisect_left(self._sorted_names, prefix), len(self._sorted_names)):
+            if not self._sorted_names[index].startswith(prefix):
+                break
+            ids.extend(self._ids_by_name[self._sorted_names[index]])
+        return ids
+
+    def ids_with_tags(self, tags):
+        """ Returns the set of the ids of the tasks having one of the tags `tags` """
+        return set(taskid for tag in tags for taskid in self._ids_by_tag.get(tag, []))
+
+
+def task_files_signature(course):
+    """ Returns the list of the task descriptors of the course with their modification time """
+    course_fs = course.get_fs()
+    signature = []
+    for folder in sorted(course_fs.list(folders=True, files=False, recursive=False)):
+        task_fs = course_fs.from_subfolder(folder.strip("/"))
+        for descriptor in TASK_DESCRIPTORS:
+            if task_fs.exists(descriptor):
+                signature.append((folder, descriptor, task_fs.get_last_modification_time(descriptor)))
+    return signature
+
+
+class TaskIndexCache(object):
+    """
+    The index of the tasks of each course, rebuilt when the task descriptors
+    of the course change (checked at most every `CHECK_INTERVAL` seconds).
+    """
+
+    def __init__(self, check_interval=CHECK_INTERVAL):
+        self._indexes = {}  # courseid -> (time of the last check, signature, index)
+        self._lock = threading.Lock()
+        self.check_interval = check_interval
+
+    def get(self, course):
+        """ Returns the `TaskIndex` of the course `course` """
+        courseid = course.get_id()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._indexes.get(courseid)
+        if entry is not None and now - entry[0] < self.check_interval:
+            return entry[2]
+
+        signature = task_files_signature(course)
+        if entry is not None and entry[1] == signature:
+            index = entry[2]
+        else:
+            index = TaskIndex(course.get_tasks())
+        with self._lock:
+            self._indexes[courseid] = (now, signature, index)
+        return index
@@ -0,0 +1,29 @@
+"""
+Plugin for INGInious released under AGPL-3.0
+Created by a team at OpenWeek2019
+Florian Damhaut, Céline Deknop, Simon Gustin and Maxime Mawait
+"""
+
+import importlib
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope="session")
+def plugin():
+    """ The plugin module (its directory name is not a valid module name) """
+    pytest.importorskip("numpy")
+    pytest.importorskip("inginious")
+    return importlib.import_module("inginious-stats")
+
+
+@pytest.fixture
+def database():
+    """ An empty in-memory database (requires mongomock) """
+    mongomock = pytest.importorskip("mongomock")
+    return mongomock.MongoClient().db
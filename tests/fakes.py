@@ -0,0 +1,87 @@
+"""
+Plugin for INGInious released under AGPL-3.0
+Created by a team at OpenWeek2019
+Florian Damhaut, Céline Deknop, Simon Gustin and Maxime Mawait
+
+Stand-ins for the INGInious objects used by the plugin, and seeded submissions.
+"""
+
+import random
+from datetime import datetime, timedelta
+
+
+class Tag(object):
+    def __init__(self, tagid):
+        self._id = tagid
+
+    def get_id(self):
+        return self._id
+
+
+class Task(object):
+    """ A task whose tags are skills, misconceptions and categories, as in `Task.get_tags` """
+
+    def __init__(self, taskid, skills=(), misconceptions=(), categories=()):
+        self._id = taskid
+        self._name = "Task " + taskid
+        self._tags = ([Tag(tag) for tag in skills], [Tag(tag) for tag in misconceptions],
+                      [Tag(tag) for tag in categories])
+
+    def get_id(self):
+        return self._id
+
+    def get_name(self, language):  # pylint: disable=unused-argument
+        return self._name
+
+    def get_tags(self):
+        return self._tags
+
+
+class FileSystem(object):
+    def list(self, folders=True, files=True, recursive=False):  # pylint: disable=unused-argument
+        return []
+
+
+class Course(object):
+    def __init__(self, courseid, tasks):
+        self._id = courseid
+        self._tasks = {task.get_id(): task for task in tasks}
+
+    def get_id(self):
+        return self._id
+
+    def get_tasks(self):
+        return self._tasks
+
+    def get_fs(self):
+        return FileSystem()
+
+
+def make_course(courseid="course"):
+    return Course(courseid, [Task("loop", ["loops"], ["off_by_one"]), Task("rec", ["recursion"], [], ["exam"]),
+                             Task("both", ["loops", "recursion"])])
+
+
+def make_submissions(courseid, days=6, seed=0, end=None):
+    """
+    Returns seeded submissions of the tasks of `make_course` made during the
+    `days` days before `end`, with integer and decimal grades, teams and
+    submissions still waiting for their grade
+    """
+    rng = random.Random(seed)
+    end = end or datetime(2020, 3, 1)
+    submissions = []
+    for index in range(300):
+        submitted_on = end - timedelta(minutes=rng.randint(1, days * 24 * 60))
+        username = ["student{}".format(rng.randint(0, 15)) for __ in range(rng.choice((1, 1, 2)))]
+        submission = {"courseid": courseid, "taskid": rng.choice(("loop", "rec", "both")),
+                      "username": username, "submitted_on": submitted_on, "status": "done",
+                      "grade": rng.choice((0.0, 100.0, float(rng.randint(0, 100)), round(rng.uniform(0, 100), 2))),
+                      "tests": {"off_by_one": True} if rng.random() < 0.2 else {}}
+        submission["result"] = "success" if submission["grade"] == 100.0 else "failed"
+        if index % 25 == 0:  # waiting for the grader
+            submission["status"] = "waiting"
+            del submission["grade"]
+            del submission["result"]
+        submissions.append(submission)
+    return submissions
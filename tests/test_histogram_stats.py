@@ -0,0 +1,119 @@
+"""
+Plugin for INGInious released under AGPL-3.0
+Created by a team at OpenWeek2019
+Florian Damhaut, Céline Deknop, Simon Gustin and Maxime Mawait
+
+Statistics of the histogram mode (`compute_histogram_stats` on a grade
+summary, and the per-task summaries of `_compute_tasks_histograms`) compared
+with the exact statistics of all the grades.
+"""
+
+import random
+from datetime import datetime
+
+import pytest
+
+import fakes
+
+EXACT = ("count", "min", "max")
+MOMENTS = ("mean", "variance", "std_deviation")
+QUANTILES = ("median", "p10", "p25", "p75", "p90")
+
+
+def random_grades(seed, integers):
+    """ Returns random grades (integers, or with 2 decimals), skewed towards 0 and 100 """
+    rng = random.Random(seed)
+    grades = []
+    for __ in range(rng.randint(1, 2000)):
+        grade = rng.choice((0.0, 100.0, 100 * rng.betavariate(2, 3)))
+        grades.append(float(int(grade)) if integers else round(grade, 2))
+    return grades
+
+
+def histogram_stats(plugin, grades):
+    return plugin.compute_histogram_stats(plugin.GradeAccumulator.from_grades(grades).to_summary())
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_integer_grades_match_exact_stats(plugin, seed):
+    grades = random_grades(seed, integers=True)
+    computed = histogram_stats(plugin, grades)
+    expected = plugin.compute_advanced_stats(grades, approximate=False)
+
+    for key in EXACT + QUANTILES + ("mode",):
+        assert computed[key] == expected[key], key
+    for key in MOMENTS:
+        assert computed[key] == pytest.approx(expected[key]), key
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_decimal_grades_match_exact_stats_within_a_bucket(plugin, seed):
+    grades = random_grades(seed, integers=False)
+    computed = histogram_stats(plugin, grades)
+    expected = plugin.compute_advanced_stats(grades, approximate=False)
+
+    for key in EXACT:
+        assert computed[key] == expected[key], key
+    for key in MOMENTS:
+        assert computed[key] == pytest.approx(expected[key]), key
+    for key in QUANTILES:
+        assert abs(computed[key] - expected[key]) <= 1, key
+
+
+def test_grade_summaries_are_routed_to_histogram_stats(plugin):
+    grades = random_grades(0, integers=True)
+    summary = plugin.GradeAccumulator.from_grades(grades).to_summary()
+    assert plugin.compute_advanced_stats(summary) == plugin.compute_histogram_stats(summary)
+
+
+def test_empty_summary(plugin):
+    assert histogram_stats(plugin, []) is None
+
+
+class UserManager(object):
+    @staticmethod
+    def session_language():
+        return "en"
+
+
+def make_page(plugin, database):
+    """ Returns a statistics page reading the database `database` """
+
+    class Page(plugin.AdvancedCourseStatisticClass):
+        @property
+        def database(self):
+            return database
+
+        @property
+        def user_manager(self):
+            return UserManager
+
+    return Page()
+
+
+@pytest.mark.parametrize("rolled_up", (False, True))
+@pytest.mark.parametrize("grade_bounds", ((0, 100), (20, 80), (50, 100)))
+def test_task_summaries_match_exact_task_stats(plugin, database, rolled_up, grade_bounds):
+    course = fakes.make_course()
+    database.submissions.insert_many(fakes.make_submissions(course.get_id(), end=datetime(2020, 3, 1)))
+    if rolled_up:
+        plugin.rollups.roll_up_course(database, course.get_id(), datetime(2020, 2, 28, 12))
+    tasks = plugin.TaskIndexCache().get(course)
+    daterange = (datetime(2020, 2, 24, 18), datetime(2020, 3, 2))
+
+    page = make_page(plugin, database)
+    exact = {task["_id"]: task for task in page._compute_tasks_stats(  # pylint: disable=protected-access
+        course.get_id(), tasks, daterange, grade_bounds)}
+    computed = {task["_id"]: task for task in page._compute_tasks_histograms(  # pylint: disable=protected-access
+        course.get_id(), tasks, daterange, grade_bounds)}
+
+    assert set(computed) == set(exact)
+    for (taskid, task) in exact.items():
+        for key in ("name", "tags", "submissions", "validSubmissions", "minGrade", "maxGrade"):
+            assert computed[taskid][key] == task[key], (taskid, key)
+        assert computed[taskid]["averageGrade"] == pytest.approx(task["averageGrade"]), taskid
+        summary = plugin.GradeAccumulator.from_grades(task["allGrades"]).to_summary()
+        for key in ("count", "min", "max", "histogram"):
+            assert computed[taskid]["summary"][key] == summary[key], (taskid, key)
+        for key in ("sum", "sum_squares"):
+            assert computed[taskid]["summary"][key] == pytest.approx(summary[key]), (taskid, key)
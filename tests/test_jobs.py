@@ -0,0 +1,91 @@
+"""
+Plugin for INGInious released under AGPL-3.0
+Created by a team at OpenWeek2019
+Florian Damhaut, Céline Deknop, Simon Gustin and Maxime Mawait
+
+Charts computed in the background by the threads of `JobQueue`.
+"""
+
+import json
+import threading
+import time
+
+import pytest
+
+import fakes
+
+
+def page_class(plugin):
+    """
+    Returns a statistics page whose database and session, as in INGInious
+    (through web.ctx), can only be reached from the thread of the request
+    """
+
+    class UserManager(object):
+        @staticmethod
+        def session_language():
+            return "en"
+
+    class RequestPage(plugin.AdvancedCourseStatisticApiPage):
+        def __init__(self, database):
+            super().__init__()
+            self._request_thread = threading.current_thread()
+            self._webapp_database = database
+
+        def _check_thread(self):
+            if threading.current_thread() is not self._request_thread:
+                raise AttributeError("'ThreadedDict' object has no attribute 'app_stack'")
+
+        @property
+        def database(self):
+            self._check_thread()
+            return self._webapp_database
+
+        @property
+        def user_manager(self):
+            self._check_thread()
+            return UserManager
+
+    return RequestPage
+
+
+@pytest.fixture
+def job_queue(plugin, database):
+    plugin.JOB_QUEUE.configure(database, 1, 300)
+    plugin.RESULT_CACHE.configure(0, 0)
+    yield plugin.JOB_QUEUE
+    plugin.JOB_QUEUE.configure(None, 0, 300)
+    plugin.RESULT_CACHE.configure(128, 300)
+
+
+def wait_for(job_queue, courseid, job, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = job_queue.get(courseid, job)
+        if status["status"] in ("done", "failed"):
+            return status
+        time.sleep(0.05)
+    raise AssertionError("job {} did not complete".format(job))
+
+
+@pytest.mark.parametrize("chart_type", ("grades-distribution", "submission-before-perfect"))
+def test_job_runs_on_a_worker_thread(plugin, database, job_queue, chart_type):
+    web = pytest.importorskip("web")
+    course = fakes.make_course()
+    submissions = fakes.make_submissions(course.get_id())
+    database.submissions.insert_many(submissions)
+
+    chart_query = web.storage(stats_from='', stats_to='', chart_type=chart_type, submissions_filter='all',
+                              max_submission_grade='', min_submission_grade='', filter_tags='', filter_exercises='',
+                              time_granularity='day', timezone='', group_by='')
+    page = page_class(plugin)(database)
+    job = page._submit_job(course.get_id(), course, chart_query, plugin.parse_query(chart_query),  # pylint: disable=protected-access
+                           plugin.parse_time_options(chart_query), None, False)
+    status = wait_for(job_queue, course.get_id(), job)
+
+    assert status["status"] == "done", status.get("error")
+    statistics = json.loads(status["result"])["statistics"]
+    assert statistics is not None
+    if chart_type == "grades-distribution":
+        graded = [submission for submission in submissions if "grade" in submission]
+        assert statistics["count"] == sum(len(submission["username"]) for submission in graded)
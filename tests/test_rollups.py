@@ -0,0 +1,144 @@
+"""
+Plugin for INGInious released under AGPL-3.0
+Created by a team at OpenWeek2019
+Florian Damhaut, Céline Deknop, Simon Gustin and Maxime Mawait
+
+Rollups (`rollups.py`) compared with the statistics of the raw submissions.
+"""
+
+from datetime import datetime
+
+import pytest
+
+import fakes
+
+COURSEID = "course"
+END = datetime(2020, 3, 1)
+# Successive roll ups of the course, each one rolling up a few more days
+STEPS = (datetime(2020, 2, 26, 12), datetime(2020, 2, 28, 3), datetime(2020, 3, 2, 12))
+DATERANGES = ((datetime.min, datetime(2020, 3, 5)),
+              (datetime(2020, 2, 25, 13, 30), datetime(2020, 2, 29, 7)),
+              (datetime(2020, 2, 27), datetime(2020, 2, 28)),
+              (datetime(2020, 2, 27, 8), datetime(2020, 2, 27, 20)))
+FIELDS = ("submissions", "documents", "validSubmissions", "minGrade", "maxGrade", "histogram")
+
+
+@pytest.fixture
+def rollups(plugin):
+    return plugin.rollups
+
+
+@pytest.fixture
+def submissions(database):
+    submissions = fakes.make_submissions(COURSEID, end=END)
+    database.submissions.insert_many(submissions)
+    return submissions
+
+
+@pytest.mark.parametrize("daterange, until, expected", [
+    ((datetime(2020, 2, 25, 10), datetime(2020, 2, 28, 10)), None,
+     (None, [(datetime(2020, 2, 25, 10), datetime(2020, 2, 28, 10))])),
+    ((datetime(2020, 2, 25, 10), datetime(2020, 2, 28, 10)), datetime(2020, 3, 1),
+     ((datetime(2020, 2, 26), datetime(2020, 2, 28)),
+      [(datetime(2020, 2, 25, 10), datetime(2020, 2, 26)), (datetime(2020, 2, 28), datetime(2020, 2, 28, 10))])),
+    ((datetime(2020, 2, 25), datetime(2020, 2, 28)), datetime(2020, 3, 1),
+     ((datetime(2020, 2, 25), datetime(2020, 2, 28)), [])),
+    ((datetime(2020, 2, 25, 10), datetime(2020, 2, 28, 10)), datetime(2020, 2, 27),
+     ((datetime(2020, 2, 26), datetime(2020, 2, 27)),
+      [(datetime(2020, 2, 25, 10), datetime(2020, 2, 26)), (datetime(2020, 2, 27), datetime(2020, 2, 28, 10))])),
+    ((datetime(2020, 2, 25, 10), datetime(2020, 2, 26, 10)), datetime(2020, 3, 1),
+     (None, [(datetime(2020, 2, 25, 10), datetime(2020, 2, 26, 10))])),
+    ((datetime(2020, 2, 25, 10), datetime(2020, 2, 28, 10)), datetime(2020, 2, 20),
+     (None, [(datetime(2020, 2, 25, 10), datetime(2020, 2, 28, 10))])),
+])
+def test_split_daterange(rollups, daterange, until, expected):
+    assert rollups.split_daterange(daterange, until) == expected
+
+
+def by_task(rows):
+    return {row["_id"]: row for row in rows}
+
+
+def assert_same_rows(rows, expected):
+    assert set(rows) == set(expected)
+    for taskid in expected:
+        for field in FIELDS:
+            assert rows[taskid][field] == expected[taskid][field], (taskid, field)
+        for field in ("sumGrade", "sumSquares"):
+            assert rows[taskid][field] == pytest.approx(expected[taskid][field]), (taskid, field)
+
+
+def test_task_rows_after_each_roll_up(rollups, database, submissions):
+    for now in STEPS:
+        rollups.roll_up_course(database, COURSEID, now)
+        for daterange in DATERANGES:
+            assert_same_rows(by_task(rollups.task_rows(database, COURSEID, daterange)),
+                             by_task(rollups.raw_task_rows(database, COURSEID, daterange)))
+
+
+def test_only_graded_submissions_are_counted(rollups, database, submissions):
+    rollups.roll_up_course(database, COURSEID, STEPS[-1])
+    rows = by_task(rollups.task_rows(database, COURSEID, DATERANGES[0]))
+    for (taskid, row) in rows.items():
+        graded = [submission for submission in submissions if submission["taskid"] == taskid and "grade" in submission]
+        assert row["documents"] == len(graded)
+        assert row["submissions"] == sum(len(submission["username"]) for submission in graded)
+        assert sum(row["histogram"]) == row["submissions"]
+        assert row["sumGrade"] == pytest.approx(sum(submission["grade"] * len(submission["username"])
+                                                    for submission in graded))
+
+
+def attempts_distribution(rollups, database):
+    """ Number of attempts before success computed from the raw submissions of the whole history """
+    pipeline = rollups.attempts_pipeline(
+        {"courseid": COURSEID, "submitted_on": {"$gte": datetime.min, "$lt": DATERANGES[0][1]}}, (0, 100))
+    pipeline.append({"$group": {"_id": "$attempts", "students": {"$sum": 1}}})
+    return {row["_id"]: row["students"] for row in database.submissions.aggregate(pipeline)}
+
+
+def test_attempts_progress_after_each_roll_up(rollups, database, submissions):
+    expected = attempts_distribution(rollups, database)
+    for now in STEPS:
+        rollups.roll_up_course(database, COURSEID, now)
+        assert rollups.attempts_progress(database, COURSEID, None, DATERANGES[0]) == expected
+
+
+class FailingDatabase(object):
+    """ A database whose first write of a rollup fails, after the progress of the students is updated """
+
+    class Rollups(object):
+        def __init__(self, collection):
+            self._collection = collection
+
+        def update_one(self, *args, **kwargs):
+            raise RuntimeError("connection lost")
+
+        def __getattr__(self, name):
+            return getattr(self._collection, name)
+
+    def __init__(self, database, rollups):
+        self._database = database
+        self._rollups = rollups
+
+    def __getitem__(self, name):
+        if name == self._rollups:
+            return FailingDatabase.Rollups(self._database[name])
+        return self._database[name]
+
+    def __getattr__(self, name):
+        return getattr(self._database, name)
+
+
+def test_roll_up_again_after_a_failure(rollups, database, submissions):
+    expected = attempts_distribution(rollups, database)
+    rollups.roll_up_course(database, COURSEID, STEPS[0])
+    with pytest.raises(RuntimeError):
+        rollups.roll_up_course(FailingDatabase(database, rollups.ROLLUPS), COURSEID, STEPS[1])
+    assert rollups.get_rolled_up_until(database, COURSEID) == rollups.day_start(STEPS[0] - rollups.GRACE_PERIOD)
+
+    rollups.roll_up_course(database, COURSEID, STEPS[1])
+    rollups.roll_up_course(database, COURSEID, STEPS[2])
+    assert rollups.attempts_progress(database, COURSEID, None, DATERANGES[0]) == expected
+    for daterange in DATERANGES:
+        assert_same_rows(by_task(rollups.task_rows(database, COURSEID, daterange)),
+                         by_task(rollups.raw_task_rows(database, COURSEID, daterange)))
@@ -0,0 +1,93 @@
+"""
+Plugin for INGInious released under AGPL-3.0
+Created by a team at OpenWeek2019
+Florian Damhaut, Céline Deknop, Simon Gustin and Maxime Mawait
+
+Statistics per tag (`GradeAccumulator`, `tags_stats_from_tasks`) compared
+with a brute-force reference computed from all the grades.
+"""
+
+import random
+
+import pytest
+
+TAGS = ("loops", "recursion", "arrays", "strings", "")
+
+
+def make_tasks(seed, nb_tasks=30):
+    """ Returns random per-task statistics, as returned by `_tasks_stats` with all the grades """
+    rng = random.Random(seed)
+    tasks = []
+    for index in range(nb_tasks):
+        grades = [rng.choice((rng.randint(0, 100), round(rng.uniform(0, 100), 2)))
+                  for __ in range(rng.randint(1, 200))]
+        tasks.append({"_id": "task{}".format(index), "allGrades": grades,
+                      "submissions": len(grades), "validSubmissions": sum(1 for grade in grades if grade == 100),
+                      "tags": rng.sample(TAGS, rng.randint(0, 3))})
+    return tasks
+
+
+def with_summaries(plugin, tasks):
+    """ Returns the tasks `tasks` as returned by `_tasks_stats` in histogram mode """
+    return [dict({key: value for (key, value) in task.items() if key != "allGrades"},
+                 summary=plugin.GradeAccumulator.from_grades(task["allGrades"]).to_summary())
+            for task in tasks]
+
+
+def reference(tasks):
+    """ Brute-force statistics per tag: all the grades of the tasks of each tag, and their counters """
+    grades = {}
+    submissions = {}
+    for task in tasks:
+        for tag in task["tags"]:
+            if tag == "":
+                continue
+            grades.setdefault(tag, []).extend(task["allGrades"])
+            counts = submissions.setdefault(tag, [0, 0])
+            counts[0] += task["submissions"]
+            counts[1] += task["validSubmissions"]
+    return grades, submissions
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("histogram", (False, True))
+def test_tags_stats_match_reference(plugin, seed, histogram):
+    tasks = make_tasks(seed)
+    (grades, submissions) = reference(tasks)
+    tag_stats = plugin.tags_stats_from_tasks(with_summaries(plugin, tasks) if histogram else tasks)
+
+    assert set(tag_stats) == set(grades)
+    for (tag, stats) in tag_stats.items():
+        expected = grades[tag]
+        accumulator = stats["grades"]
+        assert [stats["submissions"], stats["validSubmissions"]] == submissions[tag]
+        assert accumulator.count == len(expected)
+        assert stats["minGrade"] == min(expected)
+        assert stats["maxGrade"] == max(expected)
+        assert stats["averageGrade"] == pytest.approx(sum(expected) / len(expected))
+        assert accumulator.sum_squares == pytest.approx(sum(grade * grade for grade in expected))
+        histogram_counts = [0] * plugin.GRADE_BINS
+        for grade in expected:
+            histogram_counts[min(int(grade), plugin.GRADE_BINS - 1)] += 1
+        assert accumulator.histogram.tolist() == histogram_counts
+
+
+def test_merge_matches_accumulator_of_all_grades(plugin):
+    rng = random.Random(0)
+    parts = [[round(rng.uniform(0, 100), 1) for __ in range(rng.randint(0, 50))] for __ in range(10)]
+    merged = plugin.GradeAccumulator()
+    for part in parts:
+        merged.merge(plugin.GradeAccumulator.from_grades(part))
+    expected = plugin.GradeAccumulator.from_grades([grade for part in parts for grade in part]).to_summary()
+    summary = merged.to_summary()
+
+    assert summary["histogram"] == expected["histogram"]
+    assert (summary["count"], summary["min"], summary["max"]) == (expected["count"], expected["min"], expected["max"])
+    assert summary["sum"] == pytest.approx(expected["sum"])
+    assert summary["sum_squares"] == pytest.approx(expected["sum_squares"])
+
+
+def test_tasks_without_tags_are_ignored(plugin):
+    tasks = [{"_id": "task", "allGrades": [50.0], "submissions": 1, "validSubmissions": 0, "tags": [""]},
+             {"_id": "other", "allGrades": [20.0], "submissions": 1, "validSubmissions": 0, "tags": []}]
+    assert plugin.tags_stats_from_tasks(tasks) == {}
@@ -0,0 +1,25 @@
+"""
+Plugin for INGInious released under AGPL-3.0
+Created by a team at OpenWeek2019
+Florian Damhaut, Céline Deknop, Simon Gustin and Maxime Mawait
+
+Tags of the task descriptors indexed by `TaskIndex`.
+"""
+
+import fakes
+
+
+def test_only_skills_and_categories_are_indexed(plugin):
+    tasks = plugin.TaskIndexCache().get(fakes.make_course())
+    assert tasks.get_tags("loop") == ["loops"]
+    assert tasks.get_tags("rec") == ["recursion", "exam"]
+    assert tasks.ids_with_tags(["loops"]) == {"loop", "both"}
+    assert tasks.ids_with_tags(["exam"]) == {"rec"}
+    assert tasks.ids_with_tags(["off_by_one"]) == set()
+
+
+def test_misconceptions_do_not_select_tasks(plugin):
+    page = plugin.AdvancedCourseStatisticClass()
+    tasks = plugin.TaskIndexCache().get(fakes.make_course())
+    assert page._get_filtered_ids(tasks, [], ["off_by_one"]) == []  # pylint: disable=protected-access
+    assert page._get_filtered_ids(tasks, [], ["off_by_one", "exam"]) == ["rec"]  # pylint: disable=protected-access